@@ -21,12 +21,34 @@ from streamlitissues.mappings import (
 from streamlitissues.utils import (
     build_context_column,
     create_snowflake_session_root,
-    query_cortex_search_service,
+    search_issues_with_store,
     parse_label_categories,
     build_prompt,
     get_response_from_cortex,
     join_issue_bodies_for_context,
     show_limit_warning,
+    get_warehouse_scheduler,
+    get_client_id,
+    get_busy_warning,
+    format_wait_time,
+    truncate_markdown,
+    paginate,
+    get_issue_store,
+    get_result_score,
+    collapse_duplicate_clusters,
+    get_model_router,
+    get_routed_response_from_cortex,
+    get_resource_limit_warning,
+    get_suggestion_index,
+)
+from streamlitissues.routing import AUTO_MODEL
+from streamlitissues.search import build_sharded_search_backend
+from streamlitissues.scheduler import (
+    Backpressure,
+    CostExceedsBudget,
+    SEARCH_PRIORITY,
+    COMPLETION_PRIORITY,
+    estimate_completion_cost,
 )
 
 # fetch snowflake connection parameters from secrets
@@ -38,6 +60,35 @@ snowflake_session, snowflake_root = create_snowflake_session_root(snowflake_para
 # create the cortex search query params
 cortex_service_params = dict(st.secrets["cortex"])
 
+# create the sharded search when the cortex parameters define shards (e.g. open vs closed issues)
+@st.cache_resource
+def get_sharded_search_backend(_snowflake_root, cortex_service_params):
+    return build_sharded_search_backend(_snowflake_root, cortex_service_params)
+
+
+sharded_search = (
+    get_sharded_search_backend(snowflake_root, cortex_service_params)
+    if "shards" in cortex_service_params
+    else None
+)
+
+# create the process-wide scheduler for the warehouse calls (shared by all sessions)
+scheduler_params = dict(st.secrets.get("scheduler", {}))
+trusted_proxy_hops = scheduler_params.pop("trusted_proxy_hops", 1)
+scheduler = get_warehouse_scheduler(scheduler_params)
+client_id = get_client_id(trusted_proxy_hops)
+
+# create the process-wide issue store (memory-mapped from the processed snapshot if available)
+local_data_params = dict(st.secrets.get("local_data", {}))
+issue_store = get_issue_store(local_data_params.get("snapshot_path"))
+
+# load the typeahead suggestion index (memory-mapped, shared by all sessions)
+suggestion_index = (
+    get_suggestion_index(local_data_params["suggestion_index_path"])
+    if "suggestion_index_path" in local_data_params
+    else None
+)
+
 # Streamlit app title and logo
 _, col, _ = st.columns([1, 2, 1])
 col.image("./media/logo.png", width=500)
@@ -51,14 +102,22 @@ def watch_demo():
 if st.button("👉 Watch the demo reel 📽️", type="tertiary"):
     watch_demo()
 
-# Initialize the search results and counter session states
+# Initialize the search results session state
+# results are stored as (issue number, score) pairs, the issues themselves live in the issue store
 if "results" not in st.session_state:
     st.session_state["results"] = None
 
-if "search_counter" not in st.session_state:
-    st.session_state["search_counter"] = 0
+# the current page of the results and the issues opened by the user
+if "results_page" not in st.session_state:
+    st.session_state["results_page"] = 0
+
+if "opened_issues" not in st.session_state:
+    st.session_state["opened_issues"] = set()
+
+RESULTS_PER_PAGE = 5
+BODY_PREVIEW_CHARS = 3000
+MAX_CHAT_MESSAGES = 40
 
-SEARCH_LIMIT = 5
 # ---------------------------------------------------------------------------- #
 #                                StreamliTissues                               #
 # ---------------------------------------------------------------------------- #
@@ -68,43 +127,116 @@ SEARCH_LIMIT = 5
 # ----------------------------- Search Form ----------------------------- #
 
 
-def submit_search_query():
+def submit_search_query(query=None):
     """Callback function to submit the search query.
-    This is defined to allow keeping track of the search counter.
+    The search goes through the shared scheduler, which charges the client's search budget.
+    Parameters:
+    query (str): The query to search, defaults to the one in the search box.
     """
-    query = st.session_state["search_query"]  # defined in the form
+    query = query or st.session_state["search_query"]  # defined in the search box
     if query:
-        # query the cortext search service
-        response = query_cortex_search_service(
-            snowflake_root=snowflake_root,
-            query_service_params=cortex_service_params,
-            query=query,
-        )
+        st.session_state["searched_query"] = query
 
-        # store the results in the session state and increment the search counter
-        st.session_state["results"] = response["results"]
-        st.session_state["search_counter"] += 1
+        # query the cortext search service
+        try:
+            if sharded_search is not None:
+                # only query the shards that can hold issues matching the state filter,
+                # the client pays for one search but every shard loads the warehouse
+                states = st.session_state.get("state_filter")
+                shards = sharded_search.select_shards(states)
+                results, failures = scheduler.run(
+                    client_id,
+                    sharded_search.search_with_failures,
+                    query,
+                    states=states,
+                    priority=SEARCH_PRIORITY,
+                    global_cost=max(1, len(shards)),
+                    slots=len(shards),
+                )
+                response = {"results": results}
+                st.session_state["searched_shards"] = {
+                    shard.name for shard in shards if shard.name not in failures
+                }
+                if failures:
+                    st.warning(
+                        f"The {', '.join(failures)} shard(s) didn't respond, so some issues "
+                        "may be missing from the results. 🫣"
+                    )
+            else:
+                response = scheduler.run(
+                    client_id,
+                    search_issues_with_store,
+                    snowflake_root=snowflake_root,
+                    query_service_params=cortex_service_params,
+                    query=query,
+                    issue_store=issue_store,
+                    priority=SEARCH_PRIORITY,
+                )
+        except Backpressure as e:
+            # the client budget is shown in the form, everything else is a busy warehouse
+            if e.reason != "client":
+                st.warning(get_busy_warning(e.expected_wait))
+            return
+        except RuntimeError:
+            # all the shards failed to respond
+            st.warning(get_resource_limit_warning())
+            return
+
+        # store the results in the session state and start over from the first page
+        if "results" in response:
+            issue_store.add_results(response["results"])
+            st.session_state["results"] = [
+                (int(result["number"]), get_result_score(result, rank))
+                for rank, result in enumerate(response["results"])
+            ]
+            st.session_state["results_page"] = 0
+            st.session_state["opened_issues"] = set()
 
     else:
         st.warning("Hmm, did you forget to enter a search query? 🤔")
 
 
-with st.form("search_form"):
+def use_suggested_query(suggested_query):
+    """Callback function to replace the search query with a suggestion."""
+    st.session_state["search_query"] = suggested_query
+
+
+# NOTE: this is not a form on purpose, pressing enter shows the (free) local suggestions
+# without spending a search, which only runs when the button is clicked
+with st.container(border=True):
     query = st.text_input(
         "Enter your search query:",
         key="search_query",
         placeholder="Ugh, the Streamlit widgetamajig doesn't work! 😭",
     )
 
-    # calculate the remaining searches and show a warning if the limit is reached
-    remaining_searches = SEARCH_LIMIT - st.session_state["search_counter"]
-    if remaining_searches < 0:
-        show_limit_warning()
+    # show the query completions and matching issue titles for the query as typed
+    if suggestion_index is not None and query and query != st.session_state.get("searched_query"):
+        suggestions = suggestion_index.suggest(query)
+        if suggestions["completions"]:
+            suggestion_cols = st.columns(len(suggestions["completions"]))
+            for suggestion_col, completion in zip(suggestion_cols, suggestions["completions"]):
+                suggestion_col.button(
+                    completion,
+                    key=f"suggestion_{completion}",
+                    type="tertiary",
+                    on_click=use_suggested_query,
+                    args=(completion,),
+                )
+        if suggestions["issues"]:
+            st.caption("Maybe one of these? (no search needed)")
+            for number, title in suggestions["issues"]:
+                st.markdown(f"- [{title}](https://github.com/streamlit/streamlit/issues/{number}) \\#{number}")
+
+    # get the remaining searches of the client and show a warning if the budget is spent
+    remaining_searches = scheduler.remaining(client_id)
+    if remaining_searches < 1:
+        show_limit_warning(scheduler.client_wait_time(client_id))
 
     # add a submit button to trigger the search
-    submit_button = st.form_submit_button(
-        label=f"Search ({remaining_searches if remaining_searches >= 0 else 0} Remaining)",
-        disabled=bool(remaining_searches < 0),
+    submit_button = st.button(
+        label=f"Search ({remaining_searches} Remaining)",
+        disabled=bool(remaining_searches < 1),
         on_click=submit_search_query,
     )
 
@@ -129,6 +261,7 @@ with st.expander("Filter and Sort Results"):
     state_filter_list = filter_col_l.segmented_control(
         "State",
         state_options,
+        key="state_filter",  # also used to pick the search shards
         default=state_options,
         selection_mode="multi",
         format_func=lambda x: state_options_emoji_mapping[x] + " " + x,
@@ -161,6 +294,26 @@ with st.expander("Filter and Sort Results"):
         ],
     )
 
+# the state filter is applied after the search, so it can't show the issues of the shards
+# the last search didn't cover: offer to search them rather than spending the budget unasked
+searched_shards = st.session_state.get("searched_shards")
+if sharded_search is not None and searched_shards is not None:
+    missing_shards = [
+        shard.name for shard in sharded_search.select_shards(state_filter_list)
+        if shard.name not in searched_shards
+    ]
+    if missing_shards:
+        st.info(
+            f"Your last search didn't cover the {', '.join(missing_shards)} issues, "
+            "so the filter can't show them yet."
+        )
+        st.button(
+            f"Search the {', '.join(missing_shards)} issues too (1 search)",
+            on_click=submit_search_query,
+            args=(st.session_state["searched_query"],),
+            disabled=bool(remaining_searches < 1),
+        )
+
 # -------------------------------- Chat Option ------------------------------- #
 
 # add a toggle to enable chat with the issues
@@ -170,9 +323,13 @@ chat_toggle = chat_col.toggle("Chat with issues", value=False)
 if chat_toggle:
     with chat_col:
         # allow the user to select a model for the chat
+        # "auto" trades off the cost, latency, and quality of the models whose context window fits the prompt
+        model_options = [AUTO_MODEL, *model_token_sizes.keys()]
         model_name = st.selectbox(
-            "Select a model", options=model_token_sizes.keys(), index=2
+            "Select a model", options=model_options, index=model_options.index("mistral-large2")
         )
+        # the chat uses the issue summaries by default, the full bodies cost a lot more tokens
+        use_full_bodies = st.toggle("Feed full issue bodies to the chat", value=False)
         # add a button to reset the chat
         if st.button("Reset Chat", type="primary"):
             st.session_state["messages"] = st.session_state["messages"][:2]
@@ -181,7 +338,113 @@ if chat_toggle:
 if chat_toggle:
     issue_col, chat_col = st.columns(2)
 else:
-    issue_col, chat_col = st, None  # this feels a bit hacky, but seems to work...
+    issue_col, chat_col = st.container(), None
+
+# ---------------------------- Display the Results --------------------------- #
+
+
+def toggle_issue(number):
+    """Callback function to open or close an issue row."""
+    opened_issues = st.session_state["opened_issues"]
+    if number in opened_issues:
+        opened_issues.remove(number)
+    else:
+        opened_issues.add(number)
+
+
+def change_results_page(step):
+    """Callback function to move between the pages of the results."""
+    st.session_state["results_page"] += step
+
+
+def show_full_body(number):
+    """Callback function to show the full body of an issue."""
+    st.session_state[f"show_full_body_{number}"] = True
+
+
+def show_issue_details(result):
+    """Display the details of an opened issue.
+    The body is truncated to BODY_PREVIEW_CHARS unless the user asks for more.
+    """
+    created_at = pd.to_datetime(result["created_at"]).strftime("%B %d, %Y")
+    reaction_count = result["reaction_total_count"]
+    st.write(f"🗓️ {created_at}  |  👍 {reaction_count}  |  🔗 [See the full issue on GitHub]({result['html_url']})")
+    st.caption("Issue Description")
+
+    body = issue_store.body(result["number"])
+    if not st.session_state.get(f"show_full_body_{result['number']}", False):
+        body, truncated = truncate_markdown(body, BODY_PREVIEW_CHARS)
+    else:
+        truncated = False
+    st.markdown(body)
+
+    if truncated:
+        st.button(
+            "Show more",
+            key=f"show_more_{result['number']}",
+            type="tertiary",
+            on_click=show_full_body,
+            args=(result["number"],),
+        )
+
+
+@st.fragment
+def show_results_page(results_df):
+    """Display a single page of the results as compact rows.
+    Only the opened issues have their bodies rendered, and opening or closing an issue
+    only reruns this fragment instead of the whole app.
+    """
+    page_df, page, n_pages = paginate(
+        results_df, st.session_state["results_page"], RESULTS_PER_PAGE
+    )
+    st.session_state["results_page"] = page
+
+    for _, result in page_df.iterrows():
+        # get the emoji for the type and state to add to the title of the rows
+        type_emoji = type_options_emoji_mapping[result["type"]]
+        state_emoji = state_options_emoji_mapping[result["state"]]
+        labels_emoji_list = [
+            label_options_emoji_mapping[label]
+            for label in result["label_categories"]
+            if label in label_options
+        ]
+
+        # create the fancy row title with the emojis and stuff
+        title = f"**{result['title'].strip()}** [\#{result['number']}  |  {state_emoji} {type_emoji}  |  {' '.join(labels_emoji_list)}]"
+        if result["duplicate_count"] > 0:
+            title += f" 👯 +{result['duplicate_count']} similar"
+
+        is_opened = result["number"] in st.session_state["opened_issues"]
+        st.button(
+            f"{'▾' if is_opened else '▸'} {title}",
+            key=f"issue_row_{result['number']}",
+            type="tertiary",
+            on_click=toggle_issue,
+            args=(result["number"],),
+        )
+        if is_opened:
+            with st.container(border=True):
+                show_issue_details(result)
+
+    # add the page navigation
+    if n_pages > 1:
+        prev_col, page_col, next_col = st.columns([1, 2, 1])
+        prev_col.button(
+            "← Previous",
+            disabled=page == 0,
+            on_click=change_results_page,
+            args=(-1,),
+            use_container_width=True,
+        )
+        page_col.caption(f"Page {page + 1} of {n_pages}")
+        next_col.button(
+            "Next →",
+            disabled=page == n_pages - 1,
+            on_click=change_results_page,
+            args=(1,),
+            use_container_width=True,
+        )
+
 
 # ---------------------------- Process the Results --------------------------- #
 
@@ -191,9 +454,12 @@ results = st.session_state["results"]
 if results is not None:
     result_caption.caption("GitHub issues last refreshed on January 10, 2024.")
 
-    # convert the results to a DataFrame for easier filtering and sorting
-    results_df = pd.DataFrame(results)
-    
+    # get the results from the issue store as a DataFrame for easier filtering and sorting
+    # the bodies are left out until they are needed
+    results_df = issue_store.to_frame(
+        [number for number, _ in results], scores=[score for _, score in results]
+    )
+
     # parse the label_categories column: remove [ and ] and split by ',' and remove duplicates
     results_df["label_categories"] = results_df["label_categories"].apply(
         parse_label_categories
@@ -215,6 +481,9 @@ if results is not None:
     # make sure each selected type is in the type column
     results_df = results_df[results_df["type"].isin(type_filter_list)]
 
+    # collapse the near-duplicate issues to their most relevant representative
+    results_df = collapse_duplicate_clusters(results_df)
+
     # sort the results (default results are sorted by relevance directly from Snowflake)
     sorting_key, ascending = sorting_mapping.get(sorting_option, (None, None))
     results_df["reaction_total_count"] = results_df["reaction_total_count"].fillna("0").astype(int)
@@ -226,34 +495,8 @@ if results is not None:
     # limit the number of results
     results_df = results_df.head(n_results)
     # ---------------------------- Display the Results ---------------------------- #
-    for _, result in results_df.iterrows():
-        # get the emoji for the type and state to add to the title in expanders
-        type_emoji = type_options_emoji_mapping[result["type"]]
-        state_emoji = state_options_emoji_mapping[result["state"]]
-        labels_emoji_list = [
-            label_options_emoji_mapping[label]
-            for label in result["label_categories"]
-            if label in label_options
-        ]
-
-        # create the fancy expander title with the emojis and stuff
-        title = f"**{result['title'].strip()}** [\#{result['number']}  |  {state_emoji} {type_emoji}  |  {' '.join(labels_emoji_list)}]"
-
-        with issue_col.expander(
-            title,
-            expanded=False,
-        ):
-            # display additional issue details
-            created_at = pd.to_datetime(result["created_at"]).strftime("%B %d, %Y")
-            reaction_count = result["reaction_total_count"]
-            st.write(f"🗓️ {created_at}  |  👍 {reaction_count}")
-
-            # display the link to Github and finally! the issue body
-            st.caption("See the full issue on GitHub:")
-            st.info(result["html_url"], icon="🔗")
-            st.divider()
-            st.caption("Issue Description")
-            st.markdown(result["body"])
+    with issue_col:
+        show_results_page(results_df)
 
 # --------------------------- Chat with the issues --------------------------- #
 
@@ -300,7 +543,15 @@ if chat_col is not None:
                 # for some reason cotex_data is being returned as empty strings by cortex
                 # the new columns will be stores as 
                 # "title: <title column> body: <body column> label_categories: <label_categories column>"
-                results_df["context"] = build_context_column(results_df)    
+                # only fetch the bodies of the issues that are missing a summary (unless asked for)
+                needs_body = use_full_bodies | (results_df["summary"].fillna("") == "")
+                results_df["body"] = [
+                    issue_store.body(number) if need else ""
+                    for number, need in zip(results_df["number"], needs_body)
+                ]
+                results_df["context"] = build_context_column(
+                    results_df, use_summaries=not use_full_bodies
+                )    
                      
                 context = join_issue_bodies_for_context(results_df["context"].tolist())
 
@@ -310,16 +561,43 @@ if chat_col is not None:
                 # Get the response from Snowflake Cortex and display it
                 with messages.chat_message("ai", avatar=avatar_mapping["ai"]):
                     with st.spinner("thinking..."):
-                        response = get_response_from_cortex(
-                            prompt_text,
-                            model_name=model_name,
-                            snowflake_session=snowflake_session,
-                            cortex_service_params=cortex_service_params,
-                        )
+                        if model_name == AUTO_MODEL:
+                            response_func = get_routed_response_from_cortex
+                            model_kwargs = {"model_router": get_model_router()}
+                        else:
+                            response_func = get_response_from_cortex
+                            model_kwargs = {"model_name": model_name}
+
+                        try:
+                            response = scheduler.run(
+                                client_id,
+                                response_func,
+                                prompt_text,
+                                **model_kwargs,
+                                snowflake_session=snowflake_session,
+                                cortex_service_params=cortex_service_params,
+                                priority=COMPLETION_PRIORITY,
+                                cost=estimate_completion_cost(prompt_text),
+                            )
+                        except CostExceedsBudget:
+                            response = "That's more context than I can take in one go. 😵‍💫 " \
+                                "Try turning off the full issue bodies or narrowing down the search."
+                        except Backpressure as e:
+                            if e.reason == "client":
+                                response = "I'd love to keep chatting, but you've used up your budget for now. 🫠 " \
+                                    f"Come back in about {format_wait_time(e.expected_wait)}."
+                            else:
+                                response = get_busy_warning(e.expected_wait)
 
                         st.session_state.messages.append(
                             {"role": "ai", "content": response}
                         )
+                        # keep the greetings and only the most recent messages
+                        if len(st.session_state.messages) > MAX_CHAT_MESSAGES:
+                            st.session_state["messages"] = (
+                                st.session_state.messages[:2]
+                                + st.session_state.messages[-(MAX_CHAT_MESSAGES - 2):]
+                            )
                         st.markdown(response)
 
     elif chat_password == "":
@@ -0,0 +1,320 @@
+"""Batch triage: run many queries through the search (and optionally the chat) from the command line.
+
+Example:
+python -m streamlitissues.batch new_issues.jsonl triage.jsonl --backend local --snapshot issues.snap
+python -m streamlitissues.batch new_issues.jsonl triage.jsonl --complete --workers 16
+
+Every input line is a JSON object with a "query" and an optional "id". Every output line
+holds the results of one query along with its timings. Queries already in the output file
+(without an error) are skipped, so an interrupted run can simply be started again.
+"""
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import toml
+
+from streamlitissues.issue_store import IssueStore
+from streamlitissues.mappings import model_token_sizes, model_cost_mapping, model_quality_mapping
+from streamlitissues.routing import AUTO_MIN_QUALITY, AUTO_MODEL, ModelRouter
+from streamlitissues.search import CortexSearchBackend, LocalSearchBackend
+from streamlitissues.utils import (
+    build_context_column,
+    build_prompt,
+    collapse_duplicate_clusters,
+    complete_with_cortex,
+    complete_with_model_router,
+    create_snowflake_session_root,
+    get_result_score,
+    join_issue_bodies_for_context,
+)
+
+TRIAGE_QUESTION = (
+    "A user is about to open the following new issue. Which of the existing issues in the "
+    "context are duplicates of it or closely related to it, and why?\n\nNew issue: {query}"
+)
+
+
+def read_queries(input_path):
+    """Read the queries from a JSONL file, using the line number as the default id."""
+    queries = []
+    with open(input_path) as f:
+        for line_number, line in enumerate(f):
+            if line.strip():
+                query = json.loads(line)
+                query.setdefault("id", line_number)
+                queries.append(query)
+    return queries
+
+
+def read_completed_ids(output_path):
+    """Read the ids of the queries that were already processed successfully."""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if record.get("error") is None:
+                    completed.add(record["id"])
+                else:
+                    completed.discard(record["id"])
+    return completed
+
+
+def call_with_timeout(func, timeout, in_flight=None):
+    """Call func in a daemon thread and raise TimeoutError if it doesn't return in time.
+
+    A hanging call can't be cancelled, but it no longer holds up the worker (nor the exit).
+    The `in_flight` semaphore is only released when the call actually returns, so the calls
+    left hanging keep counting against it and the warehouse never sees more of them.
+    """
+    deadline = time.monotonic() + timeout
+    if in_flight is not None and not in_flight.acquire(timeout=max(timeout, 0)):
+        raise TimeoutError(f"no free call slot within {timeout:.1f}s")
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = func()
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            if in_flight is not None:
+                in_flight.release()
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(max(deadline - time.monotonic(), 0))
+    if thread.is_alive():
+        raise TimeoutError(f"no response within {timeout:.1f}s")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def with_retries(func, retries, deadline, in_flight=None):
+    """Call func, retrying with an exponential backoff until it succeeds or the deadline passes.
+    Every attempt is cut off at the deadline (see call_with_timeout).
+    Returns:
+    tuple: The result of func and the number of attempts.
+    """
+    for attempt in range(1, retries + 2):
+        try:
+            return call_with_timeout(func, deadline - time.monotonic(), in_flight), attempt
+        except TimeoutError:
+            raise
+        except Exception:
+            if attempt == retries + 1 or time.monotonic() + 2 ** attempt > deadline:
+                raise
+            time.sleep(2 ** attempt)
+
+
+class BatchTriage:
+    """Run a single query through the search backend and (optionally) the chat model.
+    Parameters:
+    search_backend: A backend with a search(query, limit) method (see streamlitissues.search).
+    snowflake_session (Session): The Snowflake session, required when complete is True.
+    cortex_service_params (dict): The cortex parameters, required when complete is True.
+    complete (bool): Whether to ask the chat model about each query.
+    model_name (str): The chat model, or "auto" to route each prompt.
+    limit (int): The number of search results per query.
+    n_context (int): The number of results used as the chat context.
+    retries (int): The number of retries for the search and the completion.
+    timeout (float): The wall-clock limit of a single query (search, completion, and retries) in seconds.
+    max_in_flight (int): The maximum number of search and completion calls running at once,
+        counting the calls that timed out but haven't returned yet.
+    """
+
+    def __init__(
+        self,
+        search_backend,
+        snowflake_session=None,
+        cortex_service_params=None,
+        complete=False,
+        model_name=AUTO_MODEL,
+        limit=60,
+        n_context=10,
+        retries=3,
+        timeout=300,
+        max_in_flight=8,
+    ):
+        self.search_backend = search_backend
+        self.snowflake_session = snowflake_session
+        self.cortex_service_params = cortex_service_params
+        self.complete = complete
+        self.model_name = model_name
+        self.model_router = ModelRouter(
+            model_token_sizes,
+            model_cost_mapping,
+            model_quality=model_quality_mapping,
+            min_quality=AUTO_MIN_QUALITY,
+        )
+        self.limit = limit
+        self.n_context = n_context
+        self.retries = retries
+        self.timeout = timeout
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def _get_response(self, prompt_text):
+        # unlike the chat, failures raise here so they are retried and recorded as errors
+        if self.model_name == AUTO_MODEL:
+            return complete_with_model_router(
+                prompt_text,
+                model_router=self.model_router,
+                snowflake_session=self.snowflake_session,
+                cortex_service_params=self.cortex_service_params,
+            )
+        response = complete_with_cortex(
+            prompt_text,
+            model_name=self.model_name,
+            snowflake_session=self.snowflake_session,
+            cortex_service_params=self.cortex_service_params,
+        )
+        return response, self.model_name
+
+    def run(self, query):
+        """Triage a single query.
+        Parameters:
+        query (dict): The query with its "id" and "query".
+
+        Returns:
+        dict: The output record of the query.
+        """
+        record = {"id": query["id"], "query": query["query"], "error": None}
+        timings = {}
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        try:
+            results, record["search_attempts"] = with_retries(
+                lambda: self.search_backend.search(query["query"], limit=self.limit),
+                self.retries,
+                deadline,
+                self.in_flight,
+            )
+            timings["search_seconds"] = time.monotonic() - start
+
+            results_df = pd.DataFrame(results)
+            if not results_df.empty:
+                results_df["score"] = [
+                    get_result_score(result, rank) for rank, result in enumerate(results)
+                ]
+                results_df = collapse_duplicate_clusters(results_df)
+            record["results"] = [
+                {key: result.get(key) for key in ("number", "title", "state", "html_url", "score")}
+                for result in results_df.to_dict("records")
+            ]
+
+            if self.complete and not results_df.empty:
+                completion_start = time.monotonic()
+                results_df = results_df.head(self.n_context)
+                results_df["context"] = build_context_column(results_df)
+                context = join_issue_bodies_for_context(results_df["context"].tolist())
+                prompt_text = build_prompt(TRIAGE_QUESTION.format(query=query["query"]), context)
+                (record["response"], record["model"]), record["completion_attempts"] = with_retries(
+                    lambda: self._get_response(prompt_text), self.retries, deadline, self.in_flight
+                )
+                timings["completion_seconds"] = time.monotonic() - completion_start
+
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+
+        timings["total_seconds"] = time.monotonic() - start
+        record["timings"] = timings
+        return record
+
+
+def run_batch(queries, triage, output_path, workers=8):
+    """Run the queries concurrently, appending each record to the output file as soon as it is done.
+    Parameters:
+    queries (list): The queries to run.
+    triage (BatchTriage): The triage runner.
+    output_path (str): The JSONL output file (also the checkpoint).
+    workers (int): The number of queries run concurrently.
+
+    Returns:
+    int: The number of queries that failed.
+    """
+    n_failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor, open(output_path, "a") as f:
+        futures = [executor.submit(triage.run, query) for query in queries]
+        for i, future in enumerate(as_completed(futures), start=1):
+            record = future.result()
+            n_failed += record["error"] is not None
+            f.write(json.dumps(record, default=str) + "\n")
+            f.flush()
+            print(
+                f"[{i}/{len(queries)}] {record['id']}: "
+                f"{'failed' if record['error'] else 'done'} in {record['timings']['total_seconds']:.1f}s"
+            )
+    return n_failed
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Triage a batch of new issues against the existing ones.")
+    parser.add_argument("input", help="JSONL file with one {\"id\": ..., \"query\": ...} object per line.")
+    parser.add_argument("output", help="JSONL file the results are appended to (also used to resume).")
+    parser.add_argument("--backend", choices=["cortex", "local"], default="cortex")
+    parser.add_argument("--snapshot", help="Issue snapshot for the local backend (see IssueProcessor.save_snapshot).")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml", help="The Streamlit secrets file.")
+    parser.add_argument("--complete", action="store_true", help="Also ask the chat model about each query.")
+    parser.add_argument("--model", default=AUTO_MODEL, choices=[AUTO_MODEL, *model_token_sizes])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300, help="Wall-clock limit of a single query in seconds, retries included.")
+    parser.add_argument("--limit", type=int, default=60, help="Number of search results per query.")
+    parser.add_argument("--n-context", type=int, default=10, help="Number of results fed to the chat model.")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+
+    snowflake_session = snowflake_root = cortex_service_params = None
+    if args.backend == "cortex" or args.complete:
+        secrets = toml.load(args.secrets)
+        cortex_service_params = dict(secrets["cortex"])
+        snowflake_session, snowflake_root = create_snowflake_session_root(dict(secrets["snowflake"]))
+        # let the warehouse cancel the statements that outlive their query
+        snowflake_session.sql(
+            f"alter session set STATEMENT_TIMEOUT_IN_SECONDS = {math.ceil(args.timeout)}"
+        ).collect()
+
+    if args.backend == "local":
+        if not args.snapshot:
+            raise SystemExit("The local backend needs an issue snapshot (--snapshot).")
+        search_backend = LocalSearchBackend(IssueStore.from_snapshot(args.snapshot))
+    else:
+        search_backend = CortexSearchBackend(snowflake_root, cortex_service_params)
+
+    triage = BatchTriage(
+        search_backend,
+        snowflake_session=snowflake_session,
+        cortex_service_params=cortex_service_params,
+        complete=args.complete,
+        model_name=args.model,
+        limit=args.limit,
+        n_context=args.n_context,
+        retries=args.retries,
+        timeout=args.timeout,
+        max_in_flight=args.workers,
+    )
+
+    completed = read_completed_ids(args.output)
+    queries = [query for query in read_queries(args.input) if query["id"] not in completed]
+    print(f"{len(completed)} queries already done, {len(queries)} to go.")
+
+    n_failed = run_batch(queries, triage, args.output, workers=args.workers)
+    if n_failed:
+        raise SystemExit(f"{n_failed} queries failed, run the same command again to retry them.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from tqdm.auto import tqdm
+
+# ---------------------------------------------------------------------------- #
+#                          Comment Thread Ingestion                            #
+# ---------------------------------------------------------------------------- #
+
+GITHUB_API_URL = "https://api.github.com"
+
+
+class ResponseCache:
+    """An on-disk cache of GitHub API responses keyed by URL.
+
+    Each entry keeps the ETag and Last-Modified headers of the response, so the next
+    request for the same URL can be made conditional and answered with a 304.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url):
+        """Get the cached entry of a URL, or None."""
+        path = self._path(url)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def set(self, url, etag, last_modified, data, next_url):
+        """Cache the response of a URL."""
+        entry = {"etag": etag, "last_modified": last_modified, "data": data, "next_url": next_url}
+        # write to a temporary file first so an interrupted run never leaves a broken entry
+        path = self._path(url)
+        with open(path + ".tmp", "w") as f:
+            json.dump(entry, f)
+        os.replace(path + ".tmp", path)
+
+
+class RateLimiter:
+    """Pause all the requests when the GitHub rate limit is about to run out.
+
+    The limiter reads the X-RateLimit-* and Retry-After headers of every response
+    and holds back new requests until the limit resets.
+    """
+
+    def __init__(self, min_remaining=10):
+        self.min_remaining = min_remaining
+        self._resume_at = 0.0
+
+    async def wait(self):
+        """Wait until requests are allowed again."""
+        delay = self._resume_at - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def update(self, status, headers):
+        """Update the limiter from the status and headers of a response."""
+        if "Retry-After" in headers:
+            self._resume_at = max(self._resume_at, time.time() + float(headers["Retry-After"]))
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if remaining is not None and reset is not None:
+            if int(remaining) <= self.min_remaining or status in (403, 429):
+                self._resume_at = max(self._resume_at, float(reset) + 1)
+        elif status in (403, 429):
+            # no hint from GitHub (secondary rate limit), back off for a minute
+            self._resume_at = max(self._resume_at, time.time() + 60)
+
+
+def compact_comment(comment):
+    """Keep only the fields of a comment that are useful as chat context."""
+    return {
+        "user": (comment.get("user") or {}).get("login"),
+        "author_association": comment.get("author_association"),
+        "created_at": comment.get("created_at"),
+        "body": comment.get("body") or "",
+    }
+
+
+class CommentThreadFetcher:
+    """Fetch the comment threads of the issues from the GitHub API.
+
+    Requests are made concurrently over a bounded connection pool, are conditional on
+    the cached ETag/Last-Modified (304s don't count against the rate limit), and are
+    held back by the RateLimiter when the limit is about to run out.
+
+    Parameters:
+    cache_dir (str): The directory of the response cache and the fetched threads.
+    token (str): Optional GitHub token (strongly recommended, 60 vs 5000 requests per hour).
+    api_url (str): The base URL of the API, point it at a local mock server for testing.
+    max_connections (int): The maximum number of concurrent connections.
+    max_retries (int): The number of retries for rate-limited or failed requests.
+    """
+
+    def __init__(self, cache_dir, token=None, api_url=GITHUB_API_URL, max_connections=8, max_retries=3):
+        self.cache = ResponseCache(os.path.join(cache_dir, "responses"))
+        self.token = token
+        self.api_url = api_url.rstrip("/")
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.rate_limiter = RateLimiter()
+
+    def _headers(self, cached):
+        headers = {"Accept": "application/vnd.github+json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+        return headers
+
+    async def _get_page(self, session, url):
+        """Get a single page of comments, returning (comments, next_url)."""
+        cached = self.cache.get(url)
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.wait()
+            try:
+                async with session.get(url, headers=self._headers(cached)) as response:
+                    self.rate_limiter.update(response.status, response.headers)
+                    if response.status == 304:
+                        return cached["data"], cached["next_url"]
+                    if response.status == 200:
+                        data = await response.json()
+                        next_url = response.links.get("next", {}).get("url")
+                        next_url = str(next_url) if next_url is not None else None
+                        self.cache.set(
+                            url,
+                            response.headers.get("ETag"),
+                            response.headers.get("Last-Modified"),
+                            data,
+                            next_url,
+                        )
+                        return data, next_url
+                    if response.status not in (403, 429) and response.status < 500:
+                        response.raise_for_status()
+            except aiohttp.ClientConnectionError:
+                if attempt == self.max_retries:
+                    raise
+            # exponential backoff on top of whatever the rate limiter asks for
+            await asyncio.sleep(2 ** attempt)
+        raise RuntimeError(f"Giving up on {url} after {self.max_retries} retries.")
+
+    async def fetch_thread(self, session, comments_url):
+        """Fetch all the pages of a comment thread."""
+        url = comments_url.replace(GITHUB_API_URL, self.api_url, 1) + "?per_page=100"
+        comments = []
+        while url is not None:
+            page, url = await self._get_page(session, url)
+            comments += [compact_comment(comment) for comment in page]
+        return comments
+
+    async def _fetch_numbered_thread(self, session, semaphore, number, comments_url):
+        # the semaphore keeps the pending requests out of the pool so they don't time out waiting
+        async with semaphore:
+            return number, await self.fetch_thread(session, comments_url)
+
+    async def fetch_threads(self, comments_urls):
+        """Fetch the comment threads concurrently.
+        Threads that fail to download are left out, they will be picked up by the next run.
+        Parameters:
+        comments_urls (dict): issue number -> comments_url.
+
+        Returns:
+        dict: issue number -> list of compact comments.
+        """
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        timeout = aiohttp.ClientTimeout(total=60)
+        semaphore = asyncio.Semaphore(self.max_connections)
+        threads = {}
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = [
+                asyncio.ensure_future(self._fetch_numbered_thread(session, semaphore, number, url))
+                for number, url in comments_urls.items()
+            ]
+            for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+                try:
+                    number, thread = await task
+                    threads[number] = thread
+                except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+                    tqdm.write(f"Failed to fetch a comment thread: {e}")
+        return threads
+
+
+def _load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def _dump_json(data, path):
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+async def fetch_comment_threads_async(data, cache_dir, token=None, api_url=GITHUB_API_URL, max_connections=8):
+    """The coroutine behind fetch_comment_threads, await it when an event loop is already running.
+    See fetch_comment_threads for the parameters and the return value.
+    """
+    threads_dir = os.path.join(cache_dir, "threads")
+    os.makedirs(threads_dir, exist_ok=True)
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    manifest = _load_json(manifest_path, {})
+
+    issues = {}
+    stale_urls = {}
+    for number, n_comments, comments_url, updated_at in zip(
+        data["number"], data["comments"], data["comments_url"], data["updated_at"]
+    ):
+        if not n_comments or not isinstance(comments_url, str):
+            continue
+        number = int(number)
+        issues[number] = {"comments": int(n_comments), "updated_at": str(updated_at)}
+        if manifest.get(str(number)) != issues[number]:
+            stale_urls[number] = comments_url
+
+    fetcher = CommentThreadFetcher(
+        cache_dir, token=token, api_url=api_url, max_connections=max_connections
+    )
+    fetched = await fetcher.fetch_threads(stale_urls)
+
+    for number, thread in fetched.items():
+        _dump_json(thread, os.path.join(threads_dir, f"{number}.json"))
+        manifest[str(number)] = issues[number]
+    _dump_json(manifest, manifest_path)
+
+    return {
+        number: _load_json(os.path.join(threads_dir, f"{number}.json"), [])
+        for number in issues
+    }
+
+
+def fetch_comment_threads(data, cache_dir, token=None, api_url=GITHUB_API_URL, max_connections=8):
+    """Fetch the comment threads of the issues, only downloading the ones that changed.
+
+    A manifest in `cache_dir` records the comment count and updated_at of every thread
+    that was fetched. Threads are only requested again when one of those changed, and
+    even then the conditional requests are mostly answered from the response cache.
+
+    When an event loop is already running (e.g. in a Jupyter notebook), the fetch runs on
+    a private event loop in a worker thread. Await fetch_comment_threads_async instead to
+    stay on the running loop.
+
+    Parameters:
+    data (pd.DataFrame): The processed issues with number, comments, comments_url, and updated_at columns.
+    cache_dir (str): The directory of the response cache, the manifest, and the threads.
+    token (str): Optional GitHub token.
+    api_url (str): The base URL of the API, point it at a local mock server for testing.
+    max_connections (int): The maximum number of concurrent connections.
+
+    Returns:
+    dict: issue number -> list of compact comments, for every issue with comments.
+    """
+    coroutine = fetch_comment_threads_async(
+        data, cache_dir, token=token, api_url=api_url, max_connections=max_connections
+    )
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
@@ -1,8 +1,17 @@
 import pandas as pd
 import re
 import ast
+import hashlib
+import json
+import os
 from tqdm.auto import tqdm
 
+from streamlitissues.issue_store import write_snapshot
+from streamlitissues.dedup import assign_duplicate_clusters
+from streamlitissues.summarization import summarize_issues
+from streamlitissues.comments import fetch_comment_threads
+from streamlitissues.suggestions import build_suggestion_index
+
 
 class IssueProcessor:
 
@@ -36,8 +45,12 @@ class IssueProcessor:
         'other': []  # 'other' will be the default category
         }
     
-    def __init__(self, data):
+    # minimum estimated jaccard similarity of the title and body of duplicate issues
+    duplicate_threshold = 0.7
+
+    def __init__(self, data, find_duplicates=True):
         self.data = data
+        self.find_duplicates = find_duplicates
 
         self.processed_data = self.process()
 
@@ -60,6 +73,10 @@ class IssueProcessor:
 
         # create a column for training a cortex model
         data = self.create_cortex_training_data(data)
+
+        # cluster the near-duplicate issues
+        if self.find_duplicates:
+            data = self.assign_duplicate_clusters(data)
         return data
     
     @staticmethod
@@ -193,6 +210,118 @@ class IssueProcessor:
 
         return data
     
+    def assign_duplicate_clusters(self, data=None):
+        """Add the duplicate_cluster_id column to the dataframe.
+        Near-duplicate issues (based on MinHash signatures of their title and body)
+        share the same cluster id, which is the smallest issue number in the cluster.
+        Parameters:
+        data (pd.DataFrame): The input dataframe.
+
+        Returns:
+        pd.DataFrame: The dataframe with the duplicate_cluster_id column added.
+        """
+        if data is None:
+            data = self.data
+        texts = data['title'].fillna('') + '\n' + data['body'].fillna('')
+        data['duplicate_cluster_id'] = assign_duplicate_clusters(
+            data['number'].tolist(), texts.tolist(), threshold=self.duplicate_threshold
+        )
+        return data
+
+    def add_summaries(self, backend, cache_path=None, batch_size=20):
+        """Add the summary column to the processed data (optional ETL stage).
+        Summaries are cached in `cache_path` and only regenerated for the issues
+        whose updated_at changed since the last run.
+        Parameters:
+        backend (SummaryBackend): The backend generating the summaries
+            (e.g. CortexSummaryBackend, or StubSummaryBackend for tests).
+        cache_path (str): Optional JSONL file used to resume and refresh the summaries.
+        batch_size (int): The number of issues summarized per backend call.
+
+        Returns:
+        pd.DataFrame: The processed data with the summary column added.
+        """
+        self.processed_data['summary'] = summarize_issues(
+            self.processed_data, backend, cache_path=cache_path, batch_size=batch_size
+        )
+        return self.processed_data
+
+    def add_comment_threads(self, cache_dir, token=None, **fetch_kwargs):
+        """Add the comment_thread column to the processed data (optional ETL stage).
+        Only the threads of issues whose comment count or updated_at changed since the
+        last run are downloaded, see fetch_comment_threads (which also runs inside the
+        event loop of a notebook).
+        Parameters:
+        cache_dir (str): The directory of the response cache and the fetched threads.
+        token (str): Optional GitHub token.
+
+        Returns:
+        pd.DataFrame: The processed data with the comment_thread column added.
+        """
+        threads = fetch_comment_threads(self.processed_data, cache_dir, token=token, **fetch_kwargs)
+        self.processed_data['comment_thread'] = self.processed_data['number'].apply(
+            lambda number: threads.get(int(number), [])
+        )
+        return self.processed_data
+
+    def split_into_shards(self, by='state', data=None):
+        """Split the processed data into search shards.
+        Parameters:
+        by (str): 'state' for open/closed shards, or 'year' for one shard per creation year.
+        data (pd.DataFrame): The input dataframe, defaults to the processed data.
+
+        Returns:
+        dict: shard name -> pd.DataFrame.
+
+        example:
+        split_into_shards(by='year') -> {'created_2019': ..., 'created_2020': ..., ...}
+        """
+        if data is None:
+            data = self.processed_data
+        if by == 'state':
+            keys = data['state']
+        elif by == 'year':
+            keys = 'created_' + pd.to_datetime(data['created_at']).dt.year.astype(str)
+        else:
+            raise ValueError(f"Unknown shard key: {by}. Use 'state' or 'year'.")
+        return {name: shard for name, shard in data.groupby(keys)}
+
+    @staticmethod
+    def shard_fingerprint(shard):
+        """Fingerprint the content of a shard from the numbers and update times of its issues."""
+        rows = sorted(zip(shard['number'].astype(int), shard['updated_at'].astype(str)))
+        return hashlib.sha1(json.dumps(rows).encode('utf-8')).hexdigest()
+
+    def save_shards(self, output_dir, by='state'):
+        """Save the shards that changed since the last run, so only their search services need a refresh.
+        A manifest in `output_dir` keeps the fingerprint of every saved shard.
+        Parameters:
+        output_dir (str): The directory of the shard CSV files and the manifest.
+        by (str): 'state' or 'year', see split_into_shards.
+
+        Returns:
+        list: The names of the shards that were (re)written.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        manifest_path = os.path.join(output_dir, 'shards_manifest.json')
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+
+        changed_shards = []
+        for name, shard in self.split_into_shards(by=by).items():
+            fingerprint = self.shard_fingerprint(shard)
+            if manifest.get(name) == fingerprint:
+                continue
+            shard.to_csv(os.path.join(output_dir, f'{name}.csv'), index=False)
+            manifest[name] = fingerprint
+            changed_shards.append(name)
+
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return changed_shards
+
     def filter_columns(self, data=None, columns=None):
         """Filter the columns of the processed data.
         Parameters:
@@ -205,4 +334,18 @@ class IssueProcessor:
             data = self.data
         if columns is None:
             columns = self.columns
-        return data[columns]
\ No newline at end of file
+        return data[columns]
+
+    def save_snapshot(self, path):
+        """Save the processed data as a snapshot for the app's shared IssueStore.
+        Parameters:
+        path (str): The path of the snapshot file.
+        """
+        write_snapshot(self.processed_data, path)
+
+    def save_suggestion_index(self, path):
+        """Save the typeahead suggestion index built from the issue titles and labels.
+        Parameters:
+        path (str): The path of the index file.
+        """
+        build_suggestion_index(self.processed_data, path)
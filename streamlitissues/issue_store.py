@@ -0,0 +1,189 @@
+import json
+import mmap
+import struct
+import threading
+
+import pandas as pd
+
+# ---------------------------------------------------------------------------- #
+#                                  Issue Store                                 #
+# ---------------------------------------------------------------------------- #
+
+# magic bytes at the start of a snapshot file, followed by the header length
+SNAPSHOT_MAGIC = b"SITSNAP1"
+SNAPSHOT_PREFIX = struct.Struct("<8sQ")
+
+# the fields kept for every issue (the body is stored separately)
+ISSUE_FIELDS = (
+    "number",
+    "title",
+    "state",
+    "type",
+    "html_url",
+    "closed_at",
+    "created_at",
+    "updated_at",
+    "label_categories",
+    "reaction_total_count",
+    "duplicate_cluster_id",
+    "summary",
+)
+
+
+def _to_snapshot_value(field, value):
+    """Convert a processed value to the same representation returned by Cortex search."""
+    # unwrap numpy scalars so the header can be serialized
+    if hasattr(value, "item"):
+        value = value.item()
+    if field == "label_categories" and isinstance(value, (list, set, tuple)):
+        return json.dumps(list(value))
+    if field == "reaction_total_count":
+        return 0 if pd.isna(value) else int(value)
+    if value is None or (not isinstance(value, (list, dict)) and pd.isna(value)):
+        return None
+    return value if isinstance(value, (int, float, str)) else str(value)
+
+
+def write_snapshot(data, path):
+    """Write the processed issues to a snapshot file that can be memory-mapped by IssueStore.
+
+    The file starts with a small JSON header holding the issue fields in a columnar layout
+    and the offset of each body, followed by all the bodies as one utf-8 blob.
+
+    Parameters:
+    data (pd.DataFrame): The processed issues (see IssueProcessor.processed_data).
+    path (str): The path of the snapshot file.
+    """
+    fields = [field for field in ISSUE_FIELDS if field in data.columns]
+    columns = {
+        field: [_to_snapshot_value(field, value) for value in data[field]]
+        for field in fields
+    }
+
+    body_offsets, body_lengths, blob = [], [], bytearray()
+    for body in data["body"]:
+        encoded = body.encode("utf-8") if isinstance(body, str) else b""
+        body_offsets.append(len(blob))
+        body_lengths.append(len(encoded))
+        blob += encoded
+
+    header = json.dumps(
+        {"columns": columns, "body_offsets": body_offsets, "body_lengths": body_lengths}
+    ).encode("utf-8")
+
+    with open(path, "wb") as f:
+        f.write(SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, len(header)))
+        f.write(header)
+        f.write(blob)
+
+
+class IssueStore:
+    """A process-wide, read-mostly store holding each issue exactly once.
+
+    Issues are kept in a columnar layout indexed by issue number. When a snapshot is
+    loaded, the bodies stay in the memory-mapped file and are only decoded when
+    requested, so worker processes share them through the OS page cache. Issues
+    returned by the search service that are not in the snapshot are added on the fly.
+
+    Sessions only need to hold the issue numbers (and scores) of their results.
+    """
+
+    def __init__(self):
+        self._columns = {field: [] for field in ISSUE_FIELDS}
+        self._index = {}
+        # bodies are either a (offset, length) pair into the snapshot or a string
+        self._bodies = []
+        self._body_start = 0
+        self._mmap = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_snapshot(cls, path):
+        """Load a snapshot written by write_snapshot.
+        Parameters:
+        path (str): The path of the snapshot file.
+
+        Returns:
+        IssueStore: The store backed by the memory-mapped snapshot.
+        """
+        store = cls()
+        with open(path, "rb") as f:
+            store._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_length = SNAPSHOT_PREFIX.unpack_from(store._mmap, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not an issue snapshot.")
+        header_start = SNAPSHOT_PREFIX.size
+        header = json.loads(store._mmap[header_start:header_start + header_length])
+        store._body_start = header_start + header_length
+
+        n_issues = len(header["body_offsets"])
+        for field in ISSUE_FIELDS:
+            store._columns[field] = header["columns"].get(field, [None] * n_issues)
+        store._bodies = list(zip(header["body_offsets"], header["body_lengths"]))
+        store._index = {number: row for row, number in enumerate(store._columns["number"])}
+        return store
+
+    @property
+    def has_snapshot(self):
+        """Whether the store is backed by a snapshot file."""
+        return self._mmap is not None
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, number):
+        return number in self._index
+
+    def numbers(self):
+        """Get the numbers of all the issues in the store."""
+        return list(self._index)
+
+    def add_results(self, results):
+        """Add the issues returned by the search service that are not in the store yet.
+        Results without the issue fields (e.g. from a search returning only the numbers)
+        are skipped, an incomplete issue would stay in the store for good.
+        Parameters:
+        results (list): The list of result dicts returned by Cortex search.
+        """
+        with self._lock:
+            for result in results:
+                number = int(result["number"])
+                if number in self._index or "title" not in result:
+                    continue
+                row = len(self._bodies)
+                for field in ISSUE_FIELDS:
+                    self._columns[field].append(result.get(field))
+                self._columns["number"][row] = number
+                self._bodies.append(result.get("body") or "")
+                # the readers don't take the lock, so the issue is only published once it is complete
+                self._index[number] = row
+
+    def body(self, number):
+        """Get the body of an issue, decoding it from the snapshot if needed."""
+        body = self._bodies[self._index[number]]
+        if isinstance(body, tuple):
+            offset, length = body
+            start = self._body_start + offset
+            return self._mmap[start:start + length].decode("utf-8")
+        return body
+
+    def to_frame(self, numbers, scores=None, with_body=False):
+        """Build a DataFrame of the given issues in the given order.
+        Parameters:
+        numbers (list): The issue numbers. Numbers missing from the store are skipped.
+        scores (list): Optional relevance scores, one per number.
+        with_body (bool): Whether to include the (possibly large) body column.
+
+        Returns:
+        pd.DataFrame: One row per issue with the ISSUE_FIELDS columns.
+        """
+        rows = [(i, self._index[number]) for i, number in enumerate(numbers) if number in self._index]
+        data = pd.DataFrame(
+            {field: [self._columns[field][row] for _, row in rows] for field in ISSUE_FIELDS}
+        )
+        if scores is not None:
+            data["score"] = [scores[i] for i, _ in rows]
+        if with_body:
+            data["body"] = [self.body(numbers[i]) for i, _ in rows]
+        return data
@@ -48,4 +48,32 @@ model_token_sizes = {
     "llama3.2-3b": 128000,
     "gemma-7b": 8000,
     "snowflake-arctic": 4096,
-}
\ No newline at end of file
+}
+
+# mapping for the model costs used by the "auto" model routing
+# values are the Snowflake credits per million tokens processed by the COMPLETE function
+model_cost_mapping = {
+    "mistral-7b": 0.12,
+    "mistral-large": 5.10,
+    "mistral-large2": 1.95,
+    "mixtral-8x7b": 0.22,
+    "llama2-70b-chat": 0.45,
+    "llama3.2-1b": 0.04,
+    "llama3.2-3b": 0.06,
+    "gemma-7b": 0.12,
+    "snowflake-arctic": 0.84,
+}
+
+# mapping for the answer quality tier of each model used by the "auto" model routing
+# 3: the flagship models, 2: the large open models, 1: the small models
+model_quality_mapping = {
+    "mistral-7b": 1,
+    "mistral-large": 3,
+    "mistral-large2": 3,
+    "mixtral-8x7b": 2,
+    "llama2-70b-chat": 2,
+    "llama3.2-1b": 1,
+    "llama3.2-3b": 1,
+    "gemma-7b": 1,
+    "snowflake-arctic": 2,
+}
@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import deque
+
+# ---------------------------------------------------------------------------- #
+#                              Chat Model Routing                              #
+# ---------------------------------------------------------------------------- #
+
+AUTO_MODEL = "auto"
+# the lowest quality tier the "auto" model may route to (see mappings.model_quality_mapping)
+# the small models are left out, the quality of the others is traded off with their cost and latency
+AUTO_MIN_QUALITY = 2
+
+
+def estimate_token_count(text, chars_per_token=3.5):
+    """Estimate the number of tokens in a text without a COUNT_TOKENS round-trip.
+    The estimate errs on the high side (English text averages ~4 characters per token).
+
+    Example:
+    estimate_token_count("x" * 3500) -> 1000
+    """
+    return int(len(text) / chars_per_token) + 1
+
+
+class LatencyTracker:
+    """Keep a sliding window of the observed latencies of each model."""
+
+    def __init__(self, window=100):
+        self.window = window
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name, seconds):
+        """Record the latency of a call to a model."""
+        with self._lock:
+            self._latencies.setdefault(model_name, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, model_name, q=90):
+        """Get the q-th percentile of the latencies of a model, or None if it was never called."""
+        with self._lock:
+            latencies = sorted(self._latencies.get(model_name, ()))
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q / 100))]
+
+
+class ModelRouter:
+    """Route each prompt to the best model whose context window fits it, trading off cost, latency, and quality.
+
+    Models are ranked by a weighted sum of their normalized cost, their normalized
+    latency percentile (measured from past calls), and their quality gap to the best tier.
+    Models that were never called are assumed to be as fast as `default_latency` so they
+    get a chance to be measured. Models below the `min_quality` tier are never picked.
+
+    Parameters:
+    model_token_sizes (dict): model name -> context window size in tokens.
+    model_costs (dict): model name -> cost per million tokens. Models without a cost are never picked.
+    latency_weight (float): The weight of the latency relative to the cost.
+    latency_percentile (int): The latency percentile used for the ranking.
+    reserved_output_tokens (int): The part of the context window kept free for the answer.
+    default_latency (float): The assumed latency (in seconds) of models without observations.
+    model_quality (dict): Optional model name -> quality tier. Models without a tier count as tier 0.
+    min_quality (int): The lowest quality tier a prompt may be routed to.
+    quality_weight (float): The weight of the quality gap relative to the cost.
+    """
+
+    def __init__(
+        self,
+        model_token_sizes,
+        model_costs,
+        latency_weight=0.5,
+        latency_percentile=90,
+        reserved_output_tokens=1024,
+        default_latency=5.0,
+        model_quality=None,
+        min_quality=0,
+        quality_weight=1.0,
+    ):
+        self.model_token_sizes = model_token_sizes
+        self.model_costs = model_costs
+        self.latency_weight = latency_weight
+        self.latency_percentile = latency_percentile
+        self.reserved_output_tokens = reserved_output_tokens
+        self.default_latency = default_latency
+        self.model_quality = model_quality or {}
+        self.min_quality = min_quality
+        self.quality_weight = quality_weight
+        self.latencies = LatencyTracker()
+
+    def _latency(self, model_name):
+        latency = self.latencies.percentile(model_name, self.latency_percentile)
+        return self.default_latency if latency is None else latency
+
+    def candidates(self, prompt):
+        """Get the models that can fit the prompt, best first.
+        Parameters:
+        prompt (str): The prompt to route.
+
+        Returns:
+        list: The model names ordered by the routing policy.
+        """
+        n_tokens = estimate_token_count(prompt) + self.reserved_output_tokens
+        models = [
+            model_name for model_name, token_size in self.model_token_sizes.items()
+            if token_size >= n_tokens
+            and model_name in self.model_costs
+            and self.model_quality.get(model_name, 0) >= self.min_quality
+        ]
+        if not models:
+            return []
+
+        max_cost = max(self.model_costs[model_name] for model_name in models)
+        max_latency = max(self._latency(model_name) for model_name in models)
+        max_quality = max(self.model_quality.values(), default=0)
+
+        def policy_score(model_name):
+            cost = self.model_costs[model_name] / max_cost if max_cost else 0
+            latency = self._latency(model_name) / max_latency if max_latency else 0
+            quality_gap = 1 - self.model_quality.get(model_name, 0) / max_quality if max_quality else 0
+            return cost + self.latency_weight * latency + self.quality_weight * quality_gap
+
+        return sorted(models, key=policy_score)
+
+    def complete(self, prompt, try_complete):
+        """Get a completion, falling back to the next candidate when a model returns nothing.
+        Parameters:
+        prompt (str): The prompt to complete.
+        try_complete (callable): Called with a model name, returns the response or None.
+
+        Returns:
+        tuple: The response and the name of the model that produced it, or (None, None).
+        """
+        for model_name in self.candidates(prompt):
+            start = time.monotonic()
+            response = try_complete(model_name)
+            if response:
+                self.latencies.record(model_name, time.monotonic() - start)
+                return response, model_name
+        return None, None
@@ -0,0 +1,336 @@
+import heapq
+import itertools
+import threading
+import time
+
+# ---------------------------------------------------------------------------- #
+#                        Warehouse Admission Control                           #
+# ---------------------------------------------------------------------------- #
+
+# priority classes for the warehouse calls (lower value is served first)
+# cheap searches should never be stuck behind a handful of large completions
+SEARCH_PRIORITY = 0
+COMPLETION_PRIORITY = 1
+
+
+def estimate_completion_cost(prompt, chars_per_unit=10000):
+    """Estimate the budget cost of a completion call in "chat units".
+    A short prompt costs one unit, a typical prompt with ten issue bodies about two and a half.
+    Parameters:
+    prompt (str): The prompt that will be sent to the model.
+    chars_per_unit (int): The number of prompt characters that cost one extra unit.
+
+    Returns:
+    float: The cost of the completion call in chat units.
+
+    Example:
+    estimate_completion_cost("x" * 20000) -> 3.0
+    """
+    return 1.0 + len(prompt) / chars_per_unit
+
+
+class Backpressure(Exception):
+    """Raised when a warehouse call cannot be admitted right now.
+
+    Instead of letting the call hit the warehouse resource monitor, the scheduler
+    reports how long the caller is expected to wait before trying again.
+
+    Attributes:
+    expected_wait (float): The estimated wait in seconds.
+    reason (str): One of "client", "global", or "queue".
+    """
+
+    def __init__(self, expected_wait, reason):
+        self.expected_wait = expected_wait
+        self.reason = reason
+        super().__init__(f"{reason} budget exhausted, retry in ~{expected_wait:.0f}s")
+
+
+class CostExceedsBudget(Exception):
+    """Raised when a call costs more than a budget can ever hold, so waiting would not help.
+
+    Attributes:
+    cost (float): The cost of the call.
+    capacity (float): The capacity of the budget it was charged against.
+    """
+
+    def __init__(self, cost, capacity):
+        self.cost = cost
+        self.capacity = capacity
+        super().__init__(f"a call of {cost:.1f} units never fits a budget of {capacity:.1f} units")
+
+
+class TokenBucket:
+    """A thread-safe token bucket.
+
+    The bucket holds at most `capacity` tokens and refills continuously at
+    `refill_rate` tokens per second.
+    """
+
+    def __init__(self, capacity, refill_rate):
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.refill_rate)
+        self._updated_at = now
+
+    @property
+    def tokens(self):
+        """The number of tokens currently available."""
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def wait_time(self, cost=1.0):
+        """Return the seconds until `cost` tokens will be available (0 if available now)."""
+        with self._lock:
+            self._refill()
+            return self._wait_time(cost)
+
+    @property
+    def is_full(self):
+        """Whether the bucket is at capacity (and thus no different from a new bucket)."""
+        return self.tokens >= self.capacity
+
+    def _wait_time(self, cost):
+        missing = cost - self._tokens
+        if missing <= 0:
+            return 0.0
+        if self.refill_rate <= 0 or cost > self.capacity:
+            return float("inf")
+        return missing / self.refill_rate
+
+    def try_acquire(self, cost=1.0):
+        """Try to take `cost` tokens from the bucket.
+
+        Returns:
+        float: 0 if the tokens were taken, otherwise the seconds until they will be available.
+        """
+        with self._lock:
+            self._refill()
+            wait = self._wait_time(cost)
+            if wait == 0:
+                self._tokens -= cost
+            return wait
+
+    def refund(self, cost=1.0):
+        """Put `cost` tokens back into the bucket (e.g. when a call was never made)."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + cost)
+
+
+class WarehouseScheduler:
+    """Process-wide admission control for the search and completion calls.
+
+    Every call is charged against a per-client token bucket and a global token bucket,
+    and at most `max_concurrency` calls are allowed to run on the warehouse at once.
+    Each client has separate budgets for the searches and the completions, so chatting
+    about the results never eats into the searches (and vice versa). A call costing
+    more than a budget can hold raises `CostExceedsBudget` right away.
+    Calls waiting for a free slot are served from a priority queue, so searches are
+    admitted before completions. When a call cannot be admitted within `max_wait`
+    seconds, `Backpressure` is raised with the expected wait instead of failing
+    on the warehouse.
+
+    Parameters:
+    client_capacity (float): The burst search budget of a single client (in search units).
+    client_refill_per_hour (float): How many search units a client regains per hour.
+    client_chat_capacity (float): The burst completion budget of a single client (in chat units).
+    client_chat_refill_per_hour (float): How many chat units a client regains per hour.
+    global_capacity (float): The burst budget shared by all clients (search and chat units alike).
+    global_refill_per_minute (float): How many units the app regains per minute.
+    max_concurrency (int): The maximum number of concurrent warehouse calls.
+    max_wait (float): The maximum number of seconds a call may wait for a slot.
+    idle_sweep_interval (float): How often (in seconds) the idle client budgets are dropped.
+    """
+
+    def __init__(
+        self,
+        client_capacity=5,
+        client_refill_per_hour=5,
+        client_chat_capacity=30,
+        client_chat_refill_per_hour=30,
+        global_capacity=60,
+        global_refill_per_minute=20,
+        max_concurrency=4,
+        max_wait=20,
+        idle_sweep_interval=600,
+    ):
+        # (capacity, refill rate per second) of the client budget of each priority class
+        self.client_budgets = {
+            SEARCH_PRIORITY: (client_capacity, client_refill_per_hour / 3600),
+            COMPLETION_PRIORITY: (client_chat_capacity, client_chat_refill_per_hour / 3600),
+        }
+        self.global_bucket = TokenBucket(global_capacity, global_refill_per_minute / 60)
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self.idle_sweep_interval = idle_sweep_interval
+
+        # (client id, priority) -> TokenBucket
+        self._client_buckets = {}
+        self._clients_lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+        # priority queue of the calls waiting for a free slot: (priority, sequence)
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._condition = threading.Condition()
+
+        # exponentially weighted average of the call durations per priority class
+        self._average_duration = {SEARCH_PRIORITY: 2.0, COMPLETION_PRIORITY: 10.0}
+
+    # ------------------------------- Budgets ------------------------------- #
+
+    def client_bucket(self, client_id, priority=SEARCH_PRIORITY):
+        """Get (or lazily create) the token bucket of a client for a priority class."""
+        with self._clients_lock:
+            self._evict_idle_buckets()
+            bucket = self._client_buckets.get((client_id, priority))
+            if bucket is None:
+                bucket = TokenBucket(*self.client_budgets[priority])
+                self._client_buckets[(client_id, priority)] = bucket
+            return bucket
+
+    def _evict_idle_buckets(self):
+        # a full bucket is no different from a new one, so dropping it loses nothing
+        now = time.monotonic()
+        if now - self._last_sweep < self.idle_sweep_interval:
+            return
+        self._last_sweep = now
+        for key in [key for key, bucket in self._client_buckets.items() if bucket.is_full]:
+            del self._client_buckets[key]
+
+    def remaining(self, client_id, priority=SEARCH_PRIORITY):
+        """Return the number of whole units a client has left for a priority class."""
+        return int(self.client_bucket(client_id, priority).tokens)
+
+    def client_wait_time(self, client_id, cost=1.0, priority=SEARCH_PRIORITY):
+        """Return the seconds until a client can afford a call of `cost` units."""
+        return self.client_bucket(client_id, priority).wait_time(cost)
+
+    # ------------------------------- Queueing ------------------------------ #
+
+    def expected_wait(self, priority=SEARCH_PRIORITY):
+        """Estimate how long a new call of the given priority would wait for a slot."""
+        with self._condition:
+            return self._expected_wait(priority)
+
+    def _expected_wait(self, priority, ticket=None):
+        # count the calls that will be served before this one
+        ahead = sum(
+            1 for waiting in self._waiting
+            if waiting[0] <= priority and (ticket is None or waiting < ticket)
+        )
+        busy = self._active + ahead - self.max_concurrency + 1
+        if busy <= 0:
+            return 0.0
+        average = max(self._average_duration.values())
+        return busy * average / self.max_concurrency
+
+    def _acquire_slot(self, priority, max_wait, slots=1):
+        with self._condition:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            deadline = time.monotonic() + max_wait
+
+            while self._active + slots > self.max_concurrency or self._waiting[0] != ticket:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    expected = self._expected_wait(priority, ticket)
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._condition.notify_all()
+                    raise Backpressure(expected, "queue")
+                self._condition.wait(remaining)
+
+            heapq.heappop(self._waiting)
+            self._active += slots
+            # wake up the next call in line in case there is another free slot
+            self._condition.notify_all()
+
+    def _release_slot(self, priority, duration, slots=1):
+        with self._condition:
+            self._active -= slots
+            average = self._average_duration.get(priority, duration)
+            self._average_duration[priority] = 0.8 * average + 0.2 * duration
+            self._condition.notify_all()
+
+    # -------------------------------- Calls -------------------------------- #
+
+    def run(
+        self,
+        client_id,
+        func,
+        *args,
+        priority=SEARCH_PRIORITY,
+        cost=1.0,
+        global_cost=None,
+        slots=1,
+        max_wait=None,
+        **kwargs,
+    ):
+        """Run a warehouse call through the admission control.
+
+        Parameters:
+        client_id (str): The identifier of the client making the call.
+        func (callable): The function making the warehouse call.
+        priority (int): SEARCH_PRIORITY or COMPLETION_PRIORITY.
+        cost (float): The client budget cost of the call (in search units for searches, chat units for completions).
+        global_cost (float): The global budget cost of the call, defaults to `cost`. A search fanned out
+            to several shards costs the client one search but loads the warehouse once per shard.
+        slots (int): The number of concurrent warehouse calls made by func (e.g. one per search shard).
+        max_wait (float): Override the maximum number of seconds to wait for a slot.
+
+        Returns:
+        The return value of `func(*args, **kwargs)`.
+
+        Raises:
+        CostExceedsBudget: If the call costs more than the client or global budget can hold.
+        Backpressure: If the call cannot be admitted within the allowed wait.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        global_cost = cost if global_cost is None else global_cost
+        # a call can't hold more slots than there are
+        slots = max(1, min(slots, self.max_concurrency))
+
+        client_bucket = self.client_bucket(client_id, priority)
+        for bucket, bucket_cost in ((client_bucket, cost), (self.global_bucket, global_cost)):
+            if bucket_cost > bucket.capacity:
+                raise CostExceedsBudget(bucket_cost, bucket.capacity)
+
+        client_wait = client_bucket.try_acquire(cost)
+        if client_wait > 0:
+            raise Backpressure(client_wait, "client")
+
+        # wait a little for the global budget rather than bouncing the call right away
+        global_wait = self.global_bucket.try_acquire(global_cost)
+        if global_wait > 0:
+            if global_wait > max_wait:
+                client_bucket.refund(cost)
+                raise Backpressure(global_wait, "global")
+            time.sleep(global_wait)
+            if self.global_bucket.try_acquire(global_cost) > 0:
+                client_bucket.refund(cost)
+                raise Backpressure(self.global_bucket.wait_time(global_cost), "global")
+            max_wait -= global_wait
+
+        try:
+            self._acquire_slot(priority, max_wait, slots)
+        except Backpressure:
+            client_bucket.refund(cost)
+            self.global_bucket.refund(global_cost)
+            raise
+
+        start = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._release_slot(priority, time.monotonic() - start, slots)
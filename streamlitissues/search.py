@@ -0,0 +1,208 @@
+import heapq
+import math
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlitissues.dedup import TOKEN_PATTERN
+from streamlitissues.utils import query_cortex_search_service, get_result_score
+
+# ---------------------------------------------------------------------------- #
+#                               Search Backends                                #
+# ---------------------------------------------------------------------------- #
+
+# every backend has a `search(query, limit)` method returning the result dicts,
+# ordered by relevance, in the same format as the Cortex search service
+
+
+class CortexSearchBackend:
+    """Search the issues with a Cortex search service.
+    Parameters:
+    snowflake_root (Root): The root object for the Snowflake session.
+    query_service_params (dict): The database_name, schema_name, and search_service_name of the service.
+    columns (list): Optional columns to return, defaults to SEARCH_COLUMNS and the extra_search_columns of the service.
+    """
+
+    def __init__(self, snowflake_root, query_service_params, columns=None):
+        self.snowflake_root = snowflake_root
+        self.query_service_params = query_service_params
+        self.columns = columns
+
+    def search(self, query, limit=60):
+        response = query_cortex_search_service(
+            snowflake_root=self.snowflake_root,
+            query_service_params=self.query_service_params,
+            query=query,
+            limit=limit,
+            columns=self.columns,
+        )
+        # the search service returns an empty response when the warehouse hit its resource limit
+        if "results" not in response:
+            raise RuntimeError("The Cortex search service did not return any results.")
+        return response["results"]
+
+
+class LocalSearchBackend:
+    """Search the issues of an IssueStore locally with BM25 over their title and body.
+
+    Useful to run the batch triage without a warehouse, or as a baseline for Cortex.
+    Parameters:
+    issue_store (IssueStore): The store holding the issues.
+    k1 (float): The BM25 term frequency saturation.
+    b (float): The BM25 document length normalization.
+    """
+
+    def __init__(self, issue_store, k1=1.2, b=0.75):
+        self.issue_store = issue_store
+        self.k1 = k1
+        self.b = b
+
+        self._numbers = issue_store.numbers()
+        self._postings = defaultdict(list)
+        self._lengths = []
+        issues = issue_store.to_frame(self._numbers, with_body=True)
+        texts = issues["title"].fillna("") + " " + issues["body"]
+        for row, text in enumerate(texts):
+            tokens = TOKEN_PATTERN.findall(text.lower())
+            self._lengths.append(len(tokens))
+            for token, count in Counter(tokens).items():
+                self._postings[token].append((row, count))
+        self._average_length = sum(self._lengths) / max(len(self._lengths), 1)
+
+    def search(self, query, limit=60):
+        n_docs = len(self._numbers)
+        scores = defaultdict(float)
+        for token in set(TOKEN_PATTERN.findall(query.lower())):
+            postings = self._postings.get(token, ())
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for row, count in postings:
+                length_norm = 1 - self.b + self.b * self._lengths[row] / self._average_length
+                scores[row] += idf * count * (self.k1 + 1) / (count + self.k1 * length_norm)
+
+        top_rows = heapq.nlargest(limit, scores, key=scores.get)
+        numbers = [self._numbers[row] for row in top_rows]
+        results = self.issue_store.to_frame(numbers, with_body=True).to_dict("records")
+        for result, row in zip(results, top_rows):
+            result["@scores"] = {"text_match": scores[row]}
+        return results
+
+
+class ShardedSearchError(RuntimeError):
+    """Raised when every shard of a sharded search failed, wrapping the first error."""
+
+
+class SearchShard:
+    """A search backend holding a subset of the issues.
+    Parameters:
+    name (str): The name of the shard.
+    backend: The search backend of the shard.
+    states (list): The issue states in the shard (e.g. ["open"]), None for any state.
+    years (list): The creation years of the issues in the shard, None for any year.
+    """
+
+    def __init__(self, name, backend, states=None, years=None):
+        self.name = name
+        self.backend = backend
+        self.states = set(states) if states is not None else None
+        self.years = set(years) if years is not None else None
+
+    def matches(self, states=None, years=None):
+        """Whether the shard can hold issues with any of the given states and years."""
+        if states is not None and self.states is not None and not self.states & set(states):
+            return False
+        if years is not None and self.years is not None and not self.years & set(years):
+            return False
+        return True
+
+
+class ShardedSearchBackend:
+    """Search several shards concurrently and merge their results by score.
+
+    Only the shards that can hold issues matching the state (and year) filters are
+    queried. Each shard returns its results ordered by relevance, so the shards are
+    combined with a k-way merge on the result scores.
+
+    Parameters:
+    shards (list): The SearchShard objects.
+    max_workers (int): The maximum number of shards queried at once, defaults to all of them.
+    """
+
+    def __init__(self, shards, max_workers=None):
+        self.shards = shards
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(shards))
+
+    def select_shards(self, states=None, years=None):
+        """Get the shards that can hold issues with the given states and years."""
+        return [shard for shard in self.shards if shard.matches(states, years)]
+
+    @staticmethod
+    def _scored_results(shard, query, limit):
+        results = shard.backend.search(query, limit=limit)
+        scored = [(get_result_score(result, rank), result) for rank, result in enumerate(results)]
+        # the merge needs every shard sorted by score (a stable sort keeps the shard's ranking on ties)
+        return sorted(scored, key=lambda scored_result: -scored_result[0])
+
+    def search_with_failures(self, query, limit=60, states=None, years=None):
+        """Search the shards, reporting the ones that failed instead of dropping them silently.
+
+        Returns:
+        tuple: The merged results and a dict of shard name -> error for the failed shards.
+
+        Raises:
+        ShardedSearchError: If every shard failed.
+        """
+        shards = self.select_shards(states, years)
+        futures = [
+            self._executor.submit(self._scored_results, shard, query, limit) for shard in shards
+        ]
+
+        # a failing shard should not take the others down with it
+        shard_results, failures = [], {}
+        for shard, future in zip(shards, futures):
+            try:
+                shard_results.append(future.result())
+            except Exception as e:
+                failures[shard.name] = e
+        if failures and not shard_results:
+            error = next(iter(failures.values()))
+            raise ShardedSearchError(f"All {len(failures)} shards failed: {error}") from error
+
+        results, seen = [], set()
+        for _, result in heapq.merge(*shard_results, key=lambda scored: -scored[0]):
+            if result["number"] not in seen:
+                seen.add(result["number"])
+                results.append(result)
+            if len(results) == limit:
+                break
+        return results, failures
+
+    def search(self, query, limit=60, states=None, years=None):
+        """Search the shards, see search_with_failures to find out which shards failed."""
+        return self.search_with_failures(query, limit, states, years)[0]
+
+
+def build_sharded_search_backend(snowflake_root, cortex_service_params):
+    """Build a sharded Cortex search from the `shards` list of the cortex parameters.
+
+    Every shard is a dict with a name, its own search_service_name, and optional states
+    and years lists. The other connection parameters are shared with the main service.
+
+    Example (secrets.toml):
+    [[cortex.shards]]
+    name = "open"
+    search_service_name = "ISSUES_OPEN_SEARCH_SERVICE"
+    states = ["open"]
+    """
+    shards = []
+    for shard_params in cortex_service_params["shards"]:
+        query_service_params = {**cortex_service_params, **shard_params}
+        shards.append(
+            SearchShard(
+                shard_params["name"],
+                CortexSearchBackend(snowflake_root, query_service_params),
+                states=shard_params.get("states"),
+                years=shard_params.get("years"),
+            )
+        )
+    return ShardedSearchBackend(shards)
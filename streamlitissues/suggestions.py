@@ -0,0 +1,335 @@
+import argparse
+import itertools
+import mmap
+import os
+import random
+import struct
+import tempfile
+import time
+from array import array
+from collections import defaultdict
+
+import pandas as pd
+
+from streamlitissues.dedup import TOKEN_PATTERN
+
+# ---------------------------------------------------------------------------- #
+#                            Typeahead Suggestions                             #
+# ---------------------------------------------------------------------------- #
+
+# magic bytes, number of terms, titles, and crowded prefixes, and the byte offset of every section
+SUGGESTION_INDEX_MAGIC = b"SITSUGG2"
+SUGGESTION_INDEX_SECTIONS = (
+    "term_offsets",          # uint32[n_terms + 1], into term_blob
+    "postings_offsets",      # uint32[n_terms + 1], into postings
+    "postings",              # uint32[...], title ids sorted by popularity
+    "title_offsets",         # uint32[n_titles + 1], into title_blob
+    "title_numbers",         # uint32[n_titles]
+    "prefix_offsets",        # uint32[n_prefixes + 1], into prefix_blob
+    "prefix_terms_offsets",  # uint32[n_prefixes + 1], into prefix_terms
+    "prefix_terms",          # uint32[...], the top term ids of each crowded prefix, most frequent first
+    "term_blob",             # the sorted terms (utf-8)
+    "title_blob",            # the titles (utf-8)
+    "prefix_blob",           # the sorted crowded prefixes (utf-8)
+)
+SUGGESTION_INDEX_UINT32_SECTIONS = SUGGESTION_INDEX_SECTIONS[:8]
+SUGGESTION_INDEX_HEADER = struct.Struct(f"<8sIII{len(SUGGESTION_INDEX_SECTIONS) + 1}Q")
+
+
+def _label_tokens(labels):
+    """Get the tokens of the labels of an issue (e.g. "type:bug" -> ["type", "bug"])."""
+    if not isinstance(labels, (list, set, tuple)):
+        return []
+    return [token for label in labels for token in TOKEN_PATTERN.findall(str(label).lower())]
+
+
+def _crowded_prefixes(terms, frequencies, top_terms):
+    """Get the most frequent term ids of every prefix shared by more than top_terms terms.
+    Parameters:
+    terms (list): The sorted terms.
+    frequencies (list): The number of titles of each term.
+    top_terms (int): The number of term ids kept per prefix.
+
+    Returns:
+    dict: prefix (bytes) -> list of term ids, most frequent first.
+    """
+    crowded = {}
+    for length in itertools.count(1):
+        found = False
+        term_ids = (i for i in range(len(terms)) if len(terms[i]) >= length)
+        for prefix, group in itertools.groupby(term_ids, key=lambda i: terms[i][:length]):
+            group = list(group)
+            if len(group) > top_terms:
+                found = True
+                group.sort(key=lambda i: -frequencies[i])
+                crowded[prefix.encode("utf-8")] = group[:top_terms]
+        # the terms of a longer prefix are a subset of its shorter prefix, so they can't be more crowded
+        if not found:
+            return crowded
+
+
+def build_suggestion_index(data, path, top_terms=300):
+    """Build the suggestion index from the processed issues and write it to disk.
+
+    The index is a sorted term dictionary (a flattened prefix trie: all the terms sharing
+    a prefix are contiguous) with a posting list of title ids per term, plus the titles
+    themselves. Title ids are ordered by popularity (reaction count), so the first ids
+    in a posting list are the best suggestions.
+
+    Prefixes shared by more than `top_terms` terms (e.g. "st") are too crowded to rank
+    at query time, so their `top_terms` most frequent terms are precomputed.
+
+    Parameters:
+    data (pd.DataFrame): The processed issues with number, title, and optionally
+        labels, label_categories, and reaction_total_count columns.
+    path (str): The path of the index file.
+    top_terms (int): The number of terms kept per crowded prefix (see SuggestionIndex.max_scanned_terms).
+    """
+    if "reaction_total_count" in data:
+        data = data.sort_values("reaction_total_count", ascending=False, kind="stable")
+
+    postings = defaultdict(list)
+    titles, numbers = [], []
+    for title_id, issue in enumerate(data.to_dict("records")):
+        title = str(issue["title"] or "").strip()
+        titles.append(title.encode("utf-8"))
+        numbers.append(int(issue["number"]))
+        tokens = TOKEN_PATTERN.findall(title.lower())
+        tokens += _label_tokens(issue.get("labels")) + _label_tokens(issue.get("label_categories"))
+        for token in set(tokens):
+            postings[token].append(title_id)
+
+    terms = sorted(postings)
+    crowded = _crowded_prefixes(terms, [len(postings[term]) for term in terms], top_terms)
+    sections = {
+        "term_offsets": array("I", [0]),
+        "postings_offsets": array("I", [0]),
+        "postings": array("I"),
+        "title_offsets": array("I", [0]),
+        "title_numbers": array("I", numbers),
+        "prefix_offsets": array("I", [0]),
+        "prefix_terms_offsets": array("I", [0]),
+        "prefix_terms": array("I"),
+        "term_blob": bytearray(),
+        "title_blob": bytearray(),
+        "prefix_blob": bytearray(),
+    }
+    for term in terms:
+        sections["term_blob"] += term.encode("utf-8")
+        sections["term_offsets"].append(len(sections["term_blob"]))
+        sections["postings"].extend(postings[term])
+        sections["postings_offsets"].append(len(sections["postings"]))
+    for title in titles:
+        sections["title_blob"] += title
+        sections["title_offsets"].append(len(sections["title_blob"]))
+    for prefix in sorted(crowded):
+        sections["prefix_blob"] += prefix
+        sections["prefix_offsets"].append(len(sections["prefix_blob"]))
+        sections["prefix_terms"].extend(crowded[prefix])
+        sections["prefix_terms_offsets"].append(len(sections["prefix_terms"]))
+
+    # lay out the sections one after the other, aligned to 4 bytes for the uint32 views
+    section_bytes = [bytes(sections[name]) for name in SUGGESTION_INDEX_SECTIONS]
+    offsets = [SUGGESTION_INDEX_HEADER.size]
+    for section in section_bytes:
+        offsets.append(offsets[-1] + len(section) + (-len(section)) % 4)
+
+    with open(path, "wb") as f:
+        f.write(
+            SUGGESTION_INDEX_HEADER.pack(
+                SUGGESTION_INDEX_MAGIC, len(terms), len(titles), len(crowded), *offsets
+            )
+        )
+        for section in section_bytes:
+            f.write(section + b"\0" * ((-len(section)) % 4))
+
+
+class SuggestionIndex:
+    """A memory-mapped suggestion index written by build_suggestion_index.
+
+    Nothing is decoded up front: the sections are zero-copy views on the file, so
+    loading is instant and the index is shared by all the processes mapping it.
+    """
+
+    def __init__(self, path, max_scanned_terms=300):
+        self.max_scanned_terms = max_scanned_terms
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.n_terms, self.n_titles, self.n_prefixes, *offsets = SUGGESTION_INDEX_HEADER.unpack_from(
+            self._mmap, 0
+        )
+        if magic != SUGGESTION_INDEX_MAGIC:
+            raise ValueError(f"{path} is not a suggestion index.")
+
+        view = memoryview(self._mmap)
+        sections = {
+            name: view[start:end]
+            for name, start, end in zip(SUGGESTION_INDEX_SECTIONS, offsets, offsets[1:])
+        }
+        for name in SUGGESTION_INDEX_UINT32_SECTIONS:
+            sections[name] = sections[name].cast("I")
+        self._term_offsets = sections["term_offsets"]
+        self._postings_offsets = sections["postings_offsets"]
+        self._postings = sections["postings"]
+        self._title_offsets = sections["title_offsets"]
+        self._title_numbers = sections["title_numbers"]
+        self._term_blob = sections["term_blob"]
+        self._title_blob = sections["title_blob"]
+        self._crowded_prefix_offsets = sections["prefix_offsets"]
+        self._crowded_prefix_terms_offsets = sections["prefix_terms_offsets"]
+        self._crowded_prefix_terms = sections["prefix_terms"]
+        self._crowded_prefix_blob = sections["prefix_blob"]
+
+    def _term(self, i):
+        return bytes(self._term_blob[self._term_offsets[i]:self._term_offsets[i + 1]])
+
+    def _crowded_prefix(self, i):
+        return bytes(self._crowded_prefix_blob[self._crowded_prefix_offsets[i]:self._crowded_prefix_offsets[i + 1]])
+
+    @staticmethod
+    def _lower_bound(key, n, get):
+        # binary search for the first of the n sorted values >= key
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if get(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _prefix_range(self, prefix):
+        """Get the [start, end) range of the terms starting with prefix."""
+        key = prefix.encode("utf-8")
+        # every term starting with the prefix sorts before the prefix followed by 0xff
+        return (
+            self._lower_bound(key, self.n_terms, self._term),
+            self._lower_bound(key + b"\xff", self.n_terms, self._term),
+        )
+
+    def _prefix_terms(self, prefix):
+        """Get the ids of the terms starting with prefix, most frequent first (at most max_scanned_terms)."""
+        key = prefix.encode("utf-8")
+        i = self._lower_bound(key, self.n_prefixes, self._crowded_prefix)
+        if i < self.n_prefixes and self._crowded_prefix(i) == key:
+            # too many terms to rank here, they were ranked when the index was built
+            start, end = self._crowded_prefix_terms_offsets[i], self._crowded_prefix_terms_offsets[i + 1]
+            return list(self._crowded_prefix_terms[start:min(end, start + self.max_scanned_terms)])
+        start, end = self._prefix_range(prefix)
+        term_ids = sorted(
+            range(start, end),
+            key=lambda i: self._postings_offsets[i] - self._postings_offsets[i + 1],
+        )
+        return term_ids[:self.max_scanned_terms]
+
+    def _posting_list(self, i):
+        return self._postings[self._postings_offsets[i]:self._postings_offsets[i + 1]]
+
+    def title(self, title_id):
+        """Get the (issue number, title) of a title id."""
+        start, end = self._title_offsets[title_id], self._title_offsets[title_id + 1]
+        return self._title_numbers[title_id], bytes(self._title_blob[start:end]).decode("utf-8")
+
+    def complete_term(self, prefix, k=5):
+        """Get the k most frequent terms starting with prefix.
+
+        Example:
+        complete_term("datafr") -> ["dataframe", "dataframes", ...]
+        """
+        return [self._term(i).decode("utf-8") for i in self._prefix_terms(prefix)[:k]]
+
+    def suggest(self, query, k=5):
+        """Get the query completions and the matching issue titles for a partial query.
+        The last word of the query is treated as a prefix unless the query ends with a space.
+        Parameters:
+        query (str): The partial query typed by the user.
+        k (int): The maximum number of completions and titles.
+
+        Returns:
+        dict: "completions" (list of str) and "issues" (list of (number, title) tuples).
+        """
+        tokens = TOKEN_PATTERN.findall(query.lower())
+        if not tokens:
+            return {"completions": [], "issues": []}
+        if query[-1:].isspace():
+            complete_tokens, prefix = tokens, None
+        else:
+            complete_tokens, prefix = tokens[:-1], tokens[-1]
+
+        # the issues must contain all the complete tokens...
+        candidates = None
+        for token in sorted(complete_tokens, key=len, reverse=True):
+            start, end = self._prefix_range(token)
+            if start == end or self._term(start) != token.encode("utf-8"):
+                # an unknown word shouldn't wipe out all the suggestions
+                continue
+            posting_list = set(self._posting_list(start))
+            candidates = posting_list if candidates is None else candidates & posting_list
+
+        # ... and at least one term starting with the prefix
+        completions = []
+        if prefix is not None:
+            completed_terms = self.complete_term(prefix, k)
+            # replace the last (partial) word of the query with each of its completions
+            base = query[:query.lower().rfind(prefix)]
+            completions = [base + term for term in completed_terms]
+            prefix_matches = set()
+            for i in self._prefix_terms(prefix):
+                prefix_matches.update(self._posting_list(i))
+            candidates = prefix_matches if candidates is None else candidates & prefix_matches
+
+        # lower title ids are the more popular issues
+        title_ids = sorted(candidates or ())[:k]
+        return {"completions": completions, "issues": [self.title(i) for i in title_ids]}
+
+
+def benchmark_suggestions(sizes=(1_000, 10_000, 100_000), n_queries=1000, seed=42):
+    """Benchmark the suggestion latency against the corpus size on synthetic titles.
+    Returns:
+    pd.DataFrame: The build time, index size, and p50/p99 suggestion latency per corpus size.
+    """
+    rng = random.Random(seed)
+    vocabulary = [
+        "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(3, 10)))
+        for _ in range(20_000)
+    ]
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            data = pd.DataFrame({
+                "number": range(size),
+                "title": [" ".join(rng.choices(vocabulary, k=rng.randint(3, 12))) for _ in range(size)],
+                "reaction_total_count": [rng.randint(0, 100) for _ in range(size)],
+            })
+            path = os.path.join(tmp_dir, f"suggestions_{size}.idx")
+            start = time.perf_counter()
+            build_suggestion_index(data, path)
+            build_seconds = time.perf_counter() - start
+
+            index = SuggestionIndex(path)
+            latencies = []
+            for title in rng.choices(data["title"].tolist(), k=n_queries):
+                words = title.split()[:rng.randint(1, 3)]
+                words[-1] = words[-1][:rng.randint(1, len(words[-1]))]
+                start = time.perf_counter()
+                index.suggest(" ".join(words))
+                latencies.append(time.perf_counter() - start)
+
+            latencies.sort()
+            rows.append({
+                "corpus_size": size,
+                "build_seconds": build_seconds,
+                "index_mb": os.path.getsize(path) / 1e6,
+                "p50_ms": 1000 * latencies[len(latencies) // 2],
+                "p99_ms": 1000 * latencies[int(len(latencies) * 0.99)],
+            })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the suggestion latency against the corpus size.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+    print(benchmark_suggestions(args.sizes, args.queries).to_string(index=False))
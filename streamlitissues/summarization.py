@@ -0,0 +1,131 @@
+import json
+import os
+import re
+
+from tqdm.auto import tqdm
+
+from streamlitissues.dedup import TEMPLATE_LINE_PATTERN
+
+# ---------------------------------------------------------------------------- #
+#                               Issue Summaries                                #
+# ---------------------------------------------------------------------------- #
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+
+class SummaryBackend:
+    """Base class for the backends that summarize the issues during the ETL.
+
+    Subclasses implement `summarize`, which receives a batch of issue texts and
+    returns one summary per text, in the same order.
+    """
+
+    def summarize(self, texts):
+        raise NotImplementedError
+
+
+class StubSummaryBackend(SummaryBackend):
+    """A local, deterministic backend for tests and dry runs.
+
+    Strips the issue template boilerplate and keeps the first sentences of the text.
+    """
+
+    def __init__(self, max_chars=300):
+        self.max_chars = max_chars
+
+    def summarize(self, texts):
+        summaries = []
+        for text in texts:
+            text = " ".join(TEMPLATE_LINE_PATTERN.sub(" ", text or "").split())
+            summary = ""
+            for sentence in SENTENCE_PATTERN.split(text):
+                if len(summary) + len(sentence) > self.max_chars:
+                    break
+                summary = f"{summary} {sentence}".strip()
+            summaries.append(summary or text[:self.max_chars])
+        return summaries
+
+
+class CortexSummaryBackend(SummaryBackend):
+    """Summarize a whole batch of issues with a single SNOWFLAKE.CORTEX.SUMMARIZE query.
+    Parameters:
+    snowflake_session (Session): The Snowflake session.
+    max_chars (int): The texts are truncated to this length before being summarized.
+    """
+
+    def __init__(self, snowflake_session, max_chars=20000):
+        self.snowflake_session = snowflake_session
+        self.max_chars = max_chars
+
+    def summarize(self, texts):
+        # the row index is sent along with the text since the query does not preserve the order
+        values = ", ".join(["(?, ?)"] * len(texts))
+        summary_cmd = f"""select column1 as idx, SNOWFLAKE.CORTEX.SUMMARIZE(column2) as summary
+            from values {values};"""
+        params = []
+        for i, text in enumerate(texts):
+            params += [i, (text or "")[:self.max_chars]]
+
+        rows = self.snowflake_session.sql(summary_cmd, params=params).collect()
+        summaries = [""] * len(texts)
+        for row in rows:
+            summaries[row["IDX"]] = row["SUMMARY"]
+        return summaries
+
+
+def load_summary_cache(cache_path):
+    """Load the summaries saved by summarize_issues.
+    Returns:
+    dict: issue number -> (updated_at, summary). The last entry of an issue wins.
+    """
+    cache = {}
+    if cache_path is None or not os.path.exists(cache_path):
+        return cache
+    with open(cache_path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                cache[entry["number"]] = (entry["updated_at"], entry["summary"])
+    return cache
+
+
+def summarize_issues(data, backend, cache_path=None, batch_size=20):
+    """Summarize the issues, reusing the cached summaries of the issues that did not change.
+
+    The summaries are appended to `cache_path` after every batch, so an interrupted run
+    picks up where it left off. An issue is summarized again only when its updated_at changes.
+
+    Parameters:
+    data (pd.DataFrame): The processed issues with number, updated_at, title, and body columns.
+    backend (SummaryBackend): The backend generating the summaries.
+    cache_path (str): Optional JSONL file to store the summaries in.
+    batch_size (int): The number of issues summarized per backend call.
+
+    Returns:
+    list: The summary of each issue, in the order of `data`.
+    """
+    cache = load_summary_cache(cache_path)
+    numbers = [int(number) for number in data["number"]]
+    updated_at = data["updated_at"].astype(str).tolist()
+    texts = (data["title"].fillna("") + "\n" + data["body"].fillna("")).tolist()
+
+    stale_rows = [
+        row for row, number in enumerate(numbers)
+        if cache.get(number, (None,))[0] != updated_at[row]
+    ]
+
+    for start in tqdm(range(0, len(stale_rows), batch_size)):
+        batch = stale_rows[start:start + batch_size]
+        summaries = backend.summarize([texts[row] for row in batch])
+
+        entries = [
+            {"number": numbers[row], "updated_at": updated_at[row], "summary": summary}
+            for row, summary in zip(batch, summaries)
+        ]
+        for entry in entries:
+            cache[entry["number"]] = (entry["updated_at"], entry["summary"])
+        if cache_path is not None:
+            with open(cache_path, "a") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in entries)
+
+    return [cache[number][1] for number in numbers]
@@ -1,3 +1,4 @@
+import pandas as pd
 import streamlit as st
 from snowflake.core import Root
 from snowflake.snowpark import Session
@@ -5,7 +6,15 @@ from snowflake.snowpark.exceptions import SnowparkSQLException
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
 import base64
+import hashlib
 import textwrap
+import uuid
+
+from streamlitissues.scheduler import WarehouseScheduler
+from streamlitissues.issue_store import IssueStore
+from streamlitissues.routing import AUTO_MIN_QUALITY, ModelRouter, estimate_token_count
+from streamlitissues.suggestions import SuggestionIndex
+from streamlitissues.mappings import model_token_sizes, model_cost_mapping, model_quality_mapping
 
 # --------------------------- Snowflake Connection --------------------------- #
 
@@ -98,18 +107,118 @@ def create_snowflake_session_root(connection_parameters):
     return session, root
 
 
+# ---------------------------- Admission Control ----------------------------- #
+
+
+@st.cache_resource
+def get_warehouse_scheduler(scheduler_params):
+    """Create the process-wide scheduler for the warehouse calls.
+
+    The scheduler is shared by all the sessions, so the search budget of a client
+    survives browser refreshes, and the global budget protects the warehouse
+    resource monitor from being hit by everyone at once.
+
+    Parameters:
+    scheduler_params (dict): Keyword arguments passed to WarehouseScheduler.
+
+    Returns:
+    WarehouseScheduler: The shared scheduler.
+    """
+    return WarehouseScheduler(**scheduler_params)
+
+
+def _xsrf_cookie_token(cookie):
+    """Get the token of Streamlit's XSRF cookie ("2|mask|masked token|timestamp").
+    The mask changes every time the cookie is sent back, the unmasked token doesn't.
+    """
+    try:
+        _, mask, masked_token, _ = cookie.split("|")
+        mask, masked_token = bytes.fromhex(mask), bytes.fromhex(masked_token)
+    except ValueError:
+        return None
+    return bytes(byte ^ mask[i % len(mask)] for i, byte in enumerate(masked_token)) if mask else None
+
+
+def get_client_id(trusted_proxy_hops=1):
+    """Get an identifier for the client behind the current session.
+
+    Behind a proxy, the client IP is the one appended to X-Forwarded-For by the outermost
+    trusted proxy: the hops before it are set by the client and can be anything. Otherwise
+    the id is derived from Streamlit's XSRF cookie, which survives browser refreshes, and
+    falls back to an id stored in the session state when the cookie is missing.
+
+    Parameters:
+    trusted_proxy_hops (int): The number of proxies in front of the app (0 when there are none).
+    """
+    forwarded_for = [
+        hop.strip() for hop in st.context.headers.get("X-Forwarded-For", "").split(",") if hop.strip()
+    ]
+    if trusted_proxy_hops and len(forwarded_for) >= trusted_proxy_hops:
+        return forwarded_for[-trusted_proxy_hops]
+
+    token = _xsrf_cookie_token(st.context.cookies.get("_streamlit_xsrf", ""))
+    if token:
+        return "cookie:" + hashlib.sha256(token).hexdigest()[:32]
+
+    if "client_id" not in st.session_state:
+        st.session_state["client_id"] = uuid.uuid4().hex
+    return st.session_state["client_id"]
+
+
+# -------------------------------- Issue Store ------------------------------- #
+
+
+@st.cache_resource
+def get_issue_store(snapshot_path=None):
+    """Create the process-wide issue store shared by all the sessions.
+    Parameters:
+    snapshot_path (str): Optional path to a snapshot written by IssueProcessor.save_snapshot.
+
+    Returns:
+    IssueStore: The shared store, memory-mapped from the snapshot if one is given.
+    """
+    if snapshot_path:
+        return IssueStore.from_snapshot(snapshot_path)
+    return IssueStore()
+
+
+@st.cache_resource
+def get_suggestion_index(suggestion_index_path):
+    """Memory-map the typeahead suggestion index written by IssueProcessor.save_suggestion_index."""
+    return SuggestionIndex(suggestion_index_path)
+
+
+def get_result_score(result, rank):
+    """Get the relevance score of a search result.
+    Uses the cosine similarity reported by Cortex (or the text match score of the
+    local search) when available, and falls back to a score derived from the rank
+    of the result otherwise.
+
+    Example:
+    get_result_score({"number": 1}, rank=0) -> 1.0
+    """
+    scores = result.get("@scores") or {}
+    for score_name in ("cosine_similarity", "text_match"):
+        if score_name in scores:
+            return float(scores[score_name])
+    return 1.0 / (rank + 1)
+
+
 # ------------------------- Cortex Utility Functions ------------------------- #
 
 
-def join_issue_bodies_for_context(issue_body_list, max_char_limit=13000, max_issues=-1):
+def join_issue_bodies_for_context(issue_body_list, max_char_limit=13000, max_issues=None):
     """Join the issue bodies to create the context for the model.
     truncate the issue bodies to the max character limit for safe usage with COMPLETE function.
     """
+    issue_body_list = issue_body_list[:max_issues]
+    if not issue_body_list:
+        return ""
     # estimate the maximum character limit per issue
     max_char_limit_per_issue = max_char_limit // len(issue_body_list)
     # truncate the issue bodies to the max character limit
     issue_body_list_truncated = [
-        body[:max_char_limit_per_issue] for body in issue_body_list[:max_issues]
+        body[:max_char_limit_per_issue] for body in issue_body_list
     ]
     context = "\n".join(issue_body_list_truncated)
     return context
@@ -131,15 +240,46 @@ def get_model_token_count(model_name, text, snowflake_session) -> int:
     return token_count
 
 
-def query_cortex_search_service(snowflake_root, query_service_params, query, limit=60):
+# the columns returned by the cortex search service
+# columns added by the optional ETL stages are opt-in, since a search service built
+# from an older table doesn't have them (see query_cortex_search_service)
+SEARCH_COLUMNS = [
+    "number",
+    "title",
+    "body",
+    "state",
+    "html_url",
+    "closed_at",
+    "created_at",
+    "updated_at",
+    "label_categories",
+    "type",
+    "reaction_total_count",
+    "cortex_data",
+]
+
+
+def query_cortex_search_service(snowflake_root, query_service_params, query, limit=60, columns=None):
     """Query the cortex search service.
+
+    The columns written by the optional ETL stages are only requested when they are listed
+    in the `extra_search_columns` of the service parameters. Add them once the search
+    service has been rebuilt from a table that has them.
+
     Parameters:
     snowflake_root (Root): The root object for the Snowflake session.
+    query_service_params (dict): The database_name, schema_name, search_service_name, and
+        optional extra_search_columns of the service.
     query (str): The search query.
     limit (int): The maximum number of results to return.
+    columns (list): The columns to return, defaults to SEARCH_COLUMNS and the extra columns.
 
     Returns:
     dict: The search results.
+
+    Example (secrets.toml):
+    [cortex]
+    extra_search_columns = ["duplicate_cluster_id", "summary"]
     """
     # connect to the query service object using the snowflake root
     query_service = (
@@ -152,21 +292,7 @@ def query_cortex_search_service(snowflake_root, query_service_params, query, lim
         # search for the query
         response = query_service.search(
             query=query,
-            columns=[
-                "number",
-                "title",
-                "body",
-                "state",
-                "html_url",
-                "closed_at",
-                "created_at",
-                "html_url",
-                "updated_at",
-                "label_categories",
-                "type",
-                "reaction_total_count",
-                "cortex_data"
-            ],
+            columns=columns or SEARCH_COLUMNS + list(query_service_params.get("extra_search_columns", [])),
             # filter = ...
             # will be applied after the search to avoid querying the database again just to filter the results
             # there will be edge cases where the user may not be able to find the issue they are looking for because of this approach
@@ -179,6 +305,44 @@ def query_cortex_search_service(snowflake_root, query_service_params, query, lim
         return {}
 
 
+def search_issues_with_store(snowflake_root, query_service_params, query, issue_store, limit=60):
+    """Search the issues and add the hits to the issue store.
+
+    When the store has a snapshot, the search only returns the issue numbers (and scores).
+    If some of the hits are newer than the snapshot, the search is run again with all the
+    columns so they can be added to the store. Hits that still can't be stored are dropped.
+
+    Parameters:
+    snowflake_root (Root): The root object for the Snowflake session.
+    query_service_params (dict): The database_name, schema_name, and search_service_name of the service.
+    query (str): The search query.
+    issue_store (IssueStore): The store holding the issues.
+    limit (int): The maximum number of results to return.
+
+    Returns:
+    dict: The search results, every one of them in the store.
+    """
+    search_kwargs = dict(
+        snowflake_root=snowflake_root,
+        query_service_params=query_service_params,
+        query=query,
+        limit=limit,
+    )
+    if not issue_store.has_snapshot:
+        response = query_cortex_search_service(**search_kwargs)
+    else:
+        response = query_cortex_search_service(**search_kwargs, columns=["number"])
+        if any(int(result["number"]) not in issue_store for result in response.get("results", [])):
+            response = query_cortex_search_service(**search_kwargs) or response
+
+    if "results" in response:
+        issue_store.add_results(response["results"])
+        response["results"] = [
+            result for result in response["results"] if int(result["number"]) in issue_store
+        ]
+    return response
+
+
 def build_prompt(question, context):
     """Build the prompt for the Cortex model."""
     prompt = f"""
@@ -202,20 +366,24 @@ def build_prompt(question, context):
     return prompt
 
 
+def try_complete_with_cortex(prompt, model_name, snowflake_session):
+    """Call the Cortex TRY_COMPLETE function, which returns None instead of failing."""
+    cortex_cmd = "select SNOWFLAKE.CORTEX.TRY_COMPLETE(?, ?) as response"
+    response_df = snowflake_session.sql(
+        cortex_cmd, params=[model_name, prompt]
+    ).collect()
+    return response_df[0]["RESPONSE"]
+
+
 def get_response_from_cortex(
     prompt, model_name, snowflake_session, cortex_service_params
 ):
     """Get the response from the Cortex model."""
-    cortex_cmd = "select SNOWFLAKE.CORTEX.TRY_COMPLETE(?, ?) as response"
-
     snowflake_session.use_warehouse(cortex_service_params["warehouse"])
     
     try:
         # call the cortex complete function to get the response
-        response_df = snowflake_session.sql(
-            cortex_cmd, params=[model_name, prompt]
-        ).collect()
-        response = response_df[0]["RESPONSE"]
+        response = try_complete_with_cortex(prompt, model_name, snowflake_session)
     
     except SnowparkSQLException as e:
         response = None
@@ -233,15 +401,113 @@ def get_response_from_cortex(
                 and accidentally threw up! 🤢\n \I'm going to need a break...\n meanwhile\
                 meanwhile try reducing the number of issues you're feeding me!"
 
-def build_context_column(issue_data):
-    """Build the context column for the issue data by concatenating the relevant fields."""
+@st.cache_resource
+def get_model_router():
+    """Create the process-wide model router, so the latencies are measured across all sessions."""
+    return ModelRouter(
+        model_token_sizes,
+        model_cost_mapping,
+        model_quality=model_quality_mapping,
+        min_quality=AUTO_MIN_QUALITY,
+    )
+
+
+def get_routed_response_from_cortex(
+    prompt, model_router, snowflake_session, cortex_service_params
+):
+    """Get the response from the model picked by the router.
+    Falls back to the next candidate model when TRY_COMPLETE returns nothing.
+    """
+    try:
+        response, model_name = complete_with_model_router(
+            prompt, model_router, snowflake_session, cortex_service_params
+        )
+    except SnowparkSQLException as e:
+        return get_resource_limit_warning()
+    except CortexCompletionError:
+        # no round-trip to COUNT_TOKENS here, the local estimate is good enough for the message
+        token_size = estimate_token_count(prompt)
+        return f"I tried ingesting too much text (~{token_size} tokens, give or take) \
+                and none of my models could keep it down! 🤢\n I'm going to need a break...\n \
+                meanwhile try reducing the number of issues you're feeding me!"
+
+    return f"{response}\n\n*— routed to {model_name}*"
+
+
+# the chat turns the failures into messages for the user, the callers below raise them instead
+# so they can be retried (e.g. by the batch triage)
+
+
+class CortexCompletionError(Exception):
+    """Raised when no model returned a completion (e.g. the prompt didn't fit)."""
+
+
+def complete_with_cortex(prompt, model_name, snowflake_session, cortex_service_params):
+    """Get the response from the Cortex model, raising on failure.
+
+    Returns:
+    str: The response of the model.
+
+    Raises:
+    SnowparkSQLException: If the warehouse call failed (e.g. the resource limit was hit).
+    CortexCompletionError: If the model returned no completion.
+    """
+    snowflake_session.use_warehouse(cortex_service_params["warehouse"])
+    response = try_complete_with_cortex(prompt, model_name, snowflake_session)
+    if not response:
+        raise CortexCompletionError(
+            f"{model_name} returned no completion for ~{estimate_token_count(prompt)} tokens."
+        )
+    return response
+
+
+def complete_with_model_router(prompt, model_router, snowflake_session, cortex_service_params):
+    """Get the response from the model picked by the router, raising on failure.
+
+    Returns:
+    tuple: The response and the name of the model that produced it.
+
+    Raises:
+    SnowparkSQLException: If the warehouse call failed (e.g. the resource limit was hit).
+    CortexCompletionError: If none of the candidate models returned a completion.
+    """
+    snowflake_session.use_warehouse(cortex_service_params["warehouse"])
+    response, model_name = model_router.complete(
+        prompt,
+        lambda model_name: try_complete_with_cortex(prompt, model_name, snowflake_session),
+    )
+    if not response:
+        raise CortexCompletionError(
+            f"No model returned a completion for ~{estimate_token_count(prompt)} tokens."
+        )
+    return response, model_name
+
+
+def build_context_column(issue_data, use_summaries=True):
+    """Build the context column for the issue data by concatenating the relevant fields.
+    The precomputed summary is used instead of the body when available (unless use_summaries is False).
+    Only the first issue of each duplicate cluster keeps its body, the others point to it.
+    """
+    if use_summaries and "summary" in issue_data:
+        has_summary = issue_data["summary"].fillna("") != ""
+        body = issue_data["summary"].where(has_summary, issue_data["body"])
+    else:
+        body = issue_data["body"]
+    if "duplicate_cluster_id" in issue_data:
+        cluster_ids = get_duplicate_cluster_ids(issue_data)
+        # point to the issue that kept the body, not the cluster id (the smallest number in the cluster)
+        first_numbers = issue_data.groupby(cluster_ids)["number"].transform("first")
+        body = body.where(
+            ~cluster_ids.duplicated(), "(near-duplicate of issue #" + first_numbers.astype(str) + ")"
+        )
+
     context_column = (
         "<title>: " + issue_data["title"] + 
         "\n <label_categories>: " + issue_data["label_categories"].astype(str) + 
         "\n <state>: " + issue_data["state"] +
         "\n <type>: " + issue_data["type"] +
-        "\n <reaction_total_count>: " + str(issue_data["reaction_total_count"]) +
-        "\n <body>: " + issue_data["body"]
+        "\n <reaction_total_count>: " + issue_data["reaction_total_count"].astype(str) +
+        "\n <body>: " + body
     )   
 
     return context_column
@@ -265,20 +531,101 @@ def parse_label_categories(label_str):
     return set(labels)
 
 
+def truncate_markdown(text, max_chars=3000):
+    """Truncate a markdown text without leaving a code block open.
+    Parameters:
+    text (str): The markdown text.
+    max_chars (int): The maximum number of characters to keep.
+
+    Returns:
+    tuple: The (possibly) truncated text and a flag indicating whether it was truncated.
+
+    Example:
+    truncate_markdown("```\nlong traceback...```", 10) -> ("```\nlong t\n```", True)
+    """
+    if not isinstance(text, str):
+        return "", False
+    if len(text) <= max_chars:
+        return text, False
+
+    # prefer cutting at a line break so we don't chop a line in half
+    truncated = text[:max_chars]
+    last_line_break = truncated.rfind("\n")
+    if last_line_break > max_chars // 2:
+        truncated = truncated[:last_line_break]
+
+    # close the code block if the cut happened inside one
+    if truncated.count("```") % 2 == 1:
+        truncated += "\n```"
+    return truncated, True
+
+
+def get_duplicate_cluster_ids(data):
+    """Get the duplicate cluster ids as integers, issues without one form their own cluster."""
+    cluster_ids = pd.to_numeric(data["duplicate_cluster_id"], errors="coerce")
+    return cluster_ids.fillna(pd.to_numeric(data["number"])).astype(int)
+
+
+def collapse_duplicate_clusters(data):
+    """Keep only the first (i.e. most relevant) issue of each duplicate cluster.
+    Parameters:
+    data (pd.DataFrame): The results, ordered by relevance.
+
+    Returns:
+    pd.DataFrame: The representatives, with a duplicate_count column holding
+        the number of near-duplicates that were collapsed into each of them.
+    """
+    if "duplicate_cluster_id" not in data:
+        return data.assign(duplicate_count=0)
+    cluster_ids = get_duplicate_cluster_ids(data)
+    duplicate_count = cluster_ids.map(cluster_ids.value_counts()) - 1
+    return data.assign(duplicate_count=duplicate_count)[~cluster_ids.duplicated()]
+
+
+def paginate(data, page, page_size):
+    """Get a single page of a DataFrame.
+    Parameters:
+    data (pd.DataFrame): The data to paginate.
+    page (int): The page number (starting from 0), clipped to the valid range.
+    page_size (int): The number of rows per page.
+
+    Returns:
+    tuple: The rows on the page, the clipped page number, and the number of pages.
+    """
+    n_pages = max(1, -(-len(data) // page_size))
+    page = min(max(page, 0), n_pages - 1)
+    return data.iloc[page * page_size:(page + 1) * page_size], page, n_pages
+
+
 # -------------------------------- Other utils ------------------------------- #
 
 
+def format_wait_time(seconds):
+    """Format a wait time in seconds for humans.
+
+    Example:
+    format_wait_time(95) -> "2 minutes"
+    """
+    if seconds < 60:
+        return f"{max(int(seconds), 1)} seconds"
+    minutes = round(seconds / 60)
+    if minutes < 60:
+        return f"{minutes} minute{'s' if minutes > 1 else ''}"
+    hours = round(minutes / 60)
+    return f"{hours} hour{'s' if hours > 1 else ''}"
+
+
 @st.dialog("Search Limit Warning")
-def show_limit_warning():
-    st.warning("""
+def show_limit_warning(wait_time):
+    st.warning(f"""
     🚨 Oops! You've hit the search limit... 🫠
 
     So here's the deal: this app isn't sponsored (yet), which means every time you smash that search button, 
         it costs me actual money. Like the kind that could get me an overpriced coffee from that place that always misspells my name.
     
-    If you REALLY REALLY need to search again, try refreshing the browser to reset the counter. 
-        But please, go easy on me—I’ve got kids to feed, a mortgage to pay, and a mountain of 
-        bills taller than the kids' laundry pile.
+    If you REALLY REALLY need to search again, your next search will be ready in about {format_wait_time(wait_time)}. 
+        (And no, refreshing the browser won't reset it anymore.) Please go easy on me—I’ve got kids to feed, 
+        a mortgage to pay, and a mountain of bills taller than the kids' laundry pile.
     
     Thanks for your understanding and support! 🙏
                
@@ -301,6 +648,15 @@ def get_resource_limit_warning():
         """
 
 
+def get_busy_warning(wait_time):
+    return f"""
+        Whoa, it's rush hour 🚦... Lots of people are wiping their Streamlit issues right now, and the
+        Snowflake warehouse can only handle so many at once (set by me to make sure I don't accidentally go broke).
+
+        Please try again in about {format_wait_time(wait_time)}. Your search budget hasn't been charged for this one. 🙏
+        """
+
+
 def increment_search_counter():
     """Increment the search counter."""
     # search_counter = st.session_state.get("search_counter", 0)
@@ -0,0 +1,52 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlitissues.batch import BatchTriage, call_with_timeout
+
+
+class SlowBackend:
+    """A search backend that hangs for a while, recording how many calls run at once."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def search(self, query, limit=60):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.seconds)
+        with self._lock:
+            self.active -= 1
+        return []
+
+
+def test_timeout_is_enforced():
+    triage = BatchTriage(SlowBackend(seconds=5), timeout=0.2)
+
+    start = time.monotonic()
+    record = triage.run({"id": 1, "query": "q"})
+
+    assert record["error"].startswith("TimeoutError")
+    assert time.monotonic() - start < 1
+
+
+def test_hanging_calls_count_against_the_in_flight_limit():
+    backend = SlowBackend(seconds=1)
+    triage = BatchTriage(backend, timeout=0.2, max_in_flight=2)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        records = list(executor.map(triage.run, [{"id": i, "query": "q"} for i in range(6)]))
+
+    assert all(record["error"] for record in records)
+    assert backend.peak == 2
+
+
+def test_in_flight_slot_is_released_when_the_call_returns():
+    in_flight = threading.BoundedSemaphore(1)
+
+    assert call_with_timeout(lambda: 42, 1, in_flight) == 42
+    assert call_with_timeout(lambda: 43, 1, in_flight) == 43
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+from streamlitissues.comments import fetch_comment_threads
+
+# ---------------------------------------------------------------------------- #
+#                           Mock GitHub Comments API                           #
+# ---------------------------------------------------------------------------- #
+
+# path of the comments of an issue -> list of pages (one list of comments per page)
+PAGES = {
+    "/repos/o/r/issues/1/comments": [
+        [{"user": {"login": "a"}, "body": "first"}, {"user": {"login": "b"}, "body": "second"}],
+        [{"user": {"login": "c"}, "body": "third"}],
+    ],
+    "/repos/o/r/issues/2/comments": [
+        [{"user": {"login": "d"}, "body": "only"}],
+    ],
+}
+
+
+class MockGitHubHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        params = dict(param.split("=") for param in query.split("&") if param)
+        page = int(params.get("page", 1))
+        etag = f'"{path}:{page}"'
+        type(self).requests.append((path, page, self.headers.get("If-None-Match")))
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        pages = PAGES[path]
+        body = json.dumps(pages[page - 1]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        if page < len(pages):
+            next_url = f"http://{self.headers['Host']}{path}?per_page=100&page={page + 1}"
+            self.send_header("Link", f'<{next_url}>; rel="next"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_url():
+    MockGitHubHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockGitHubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def make_issues(updated_at_2="2024-01-01"):
+    return pd.DataFrame({
+        "number": [1, 2, 3],
+        "comments": [3, 1, 0],
+        "comments_url": [f"https://api.github.com/repos/o/r/issues/{n}/comments" for n in (1, 2, 3)],
+        "updated_at": ["2024-01-01", updated_at_2, "2024-01-01"],
+    })
+
+
+def test_fetch_follows_pagination(api_url, tmp_path):
+    threads = fetch_comment_threads(make_issues(), str(tmp_path), api_url=api_url)
+
+    assert set(threads) == {1, 2}
+    assert [comment["body"] for comment in threads[1]] == ["first", "second", "third"]
+    assert threads[2][0]["user"] == "d"
+    assert sorted(request[:2] for request in MockGitHubHandler.requests) == [
+        ("/repos/o/r/issues/1/comments", 1),
+        ("/repos/o/r/issues/1/comments", 2),
+        ("/repos/o/r/issues/2/comments", 1),
+    ]
+
+
+def test_manifest_skips_unchanged_threads(api_url, tmp_path):
+    first = fetch_comment_threads(make_issues(), str(tmp_path), api_url=api_url)
+    MockGitHubHandler.requests = []
+
+    second = fetch_comment_threads(make_issues(), str(tmp_path), api_url=api_url)
+
+    assert MockGitHubHandler.requests == []
+    assert second == first
+
+
+def test_changed_thread_is_revalidated_with_etag(api_url, tmp_path):
+    first = fetch_comment_threads(make_issues(), str(tmp_path), api_url=api_url)
+    MockGitHubHandler.requests = []
+
+    second = fetch_comment_threads(make_issues(updated_at_2="2024-02-01"), str(tmp_path), api_url=api_url)
+
+    # only the changed issue is requested, conditionally, and answered with a 304
+    assert MockGitHubHandler.requests == [
+        ("/repos/o/r/issues/2/comments", 1, '"/repos/o/r/issues/2/comments:1"')
+    ]
+    assert second == first
+
+
+def test_fetch_inside_running_event_loop(api_url, tmp_path):
+    async def fetch_from_notebook():
+        return fetch_comment_threads(make_issues(), str(tmp_path), api_url=api_url)
+
+    threads = asyncio.run(fetch_from_notebook())
+
+    assert len(threads[1]) == 3
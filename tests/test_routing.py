@@ -0,0 +1,46 @@
+from streamlitissues.mappings import model_cost_mapping, model_quality_mapping, model_token_sizes
+from streamlitissues.routing import AUTO_MIN_QUALITY, ModelRouter
+
+
+def make_router():
+    return ModelRouter(
+        model_token_sizes,
+        model_cost_mapping,
+        model_quality=model_quality_mapping,
+        min_quality=AUTO_MIN_QUALITY,
+    )
+
+
+def test_small_models_are_never_picked():
+    candidates = make_router().candidates("x" * 1000)
+
+    assert candidates
+    assert all(model_quality_mapping[model_name] >= AUTO_MIN_QUALITY for model_name in candidates)
+
+
+def test_small_prompts_can_go_to_cheaper_models():
+    assert make_router().candidates("x" * 10000)[0] != "mistral-large2"
+
+
+def test_large_prompts_only_go_to_models_that_fit():
+    assert make_router().candidates("x" * 200000) == ["mistral-large2"]
+
+
+def test_latency_changes_the_order():
+    router = make_router()
+    first = router.candidates("x" * 10000)[0]
+    for _ in range(10):
+        router.latencies.record(first, 60.0)
+
+    assert router.candidates("x" * 10000)[0] != first
+
+
+def test_complete_falls_back_to_the_next_candidate():
+    router = make_router()
+    first, second = router.candidates("prompt")[:2]
+
+    response, model_name = router.complete(
+        "prompt", lambda model_name: None if model_name == first else f"answer from {model_name}"
+    )
+
+    assert (response, model_name) == (f"answer from {second}", second)
@@ -0,0 +1,72 @@
+import pytest
+
+from streamlitissues.scheduler import WarehouseScheduler
+from streamlitissues.search import SearchShard, ShardedSearchBackend, ShardedSearchError
+
+
+class StaticBackend:
+    def __init__(self, results):
+        self.results = results
+
+    def search(self, query, limit=60):
+        return self.results[:limit]
+
+
+class FailingBackend:
+    def search(self, query, limit=60):
+        raise ValueError("shard is down")
+
+
+def result(number, score):
+    return {"number": number, "@scores": {"cosine_similarity": score}}
+
+
+def make_sharded_search(closed_backend):
+    return ShardedSearchBackend([
+        SearchShard("open", StaticBackend([result(1, 0.9), result(3, 0.5)]), states=["open"]),
+        SearchShard("closed", closed_backend, states=["closed"]),
+    ])
+
+
+def test_results_are_merged_by_score():
+    sharded_search = make_sharded_search(StaticBackend([result(2, 0.7), result(4, 0.1)]))
+
+    results, failures = sharded_search.search_with_failures("q")
+
+    assert [r["number"] for r in results] == [1, 2, 3, 4]
+    assert failures == {}
+
+
+def test_only_matching_shards_are_searched():
+    sharded_search = make_sharded_search(FailingBackend())
+
+    results, failures = sharded_search.search_with_failures("q", states=["open"])
+
+    assert [r["number"] for r in results] == [1, 3]
+    assert failures == {}
+
+
+def test_partial_failures_are_reported():
+    results, failures = make_sharded_search(FailingBackend()).search_with_failures("q")
+
+    assert [r["number"] for r in results] == [1, 3]
+    assert list(failures) == ["closed"]
+
+
+def test_all_shards_failing_raises_a_runtime_error():
+    sharded_search = ShardedSearchBackend([SearchShard("a", FailingBackend()), SearchShard("b", FailingBackend())])
+
+    with pytest.raises(RuntimeError) as error:
+        sharded_search.search("q")
+    assert isinstance(error.value, ShardedSearchError)
+    assert isinstance(error.value.__cause__, ValueError)
+
+
+def test_sharded_search_costs_the_client_one_search():
+    scheduler = WarehouseScheduler(client_capacity=5, global_capacity=60)
+    sharded_search = make_sharded_search(StaticBackend([result(2, 0.7)]))
+
+    scheduler.run("client", sharded_search.search, "q", global_cost=2, slots=2)
+
+    assert scheduler.remaining("client") == 4
+    assert scheduler.global_bucket.tokens == pytest.approx(58, abs=0.1)
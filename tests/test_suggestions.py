@@ -0,0 +1,38 @@
+import itertools
+
+import pandas as pd
+import pytest
+
+from streamlitissues.suggestions import SuggestionIndex, build_suggestion_index
+
+
+@pytest.fixture
+def crowded_index(tmp_path):
+    # 400 rare terms starting with "st" and one frequent one, more than max_scanned_terms
+    rare_terms = ["st" + "".join(letters) for letters in itertools.product("abcdefghij", repeat=3)][:400]
+    titles = [f"{term} thing" for term in rare_terms] + ["streamlit app crash"] * 50
+    data = pd.DataFrame({
+        "number": range(len(titles)),
+        "title": titles,
+        "reaction_total_count": [0] * len(rare_terms) + [10] * 50,
+    })
+    path = str(tmp_path / "suggestions.idx")
+    build_suggestion_index(data, path)
+    return SuggestionIndex(path)
+
+
+def test_most_frequent_terms_of_a_crowded_prefix(crowded_index):
+    assert crowded_index.complete_term("st")[0] == "streamlit"
+    assert crowded_index.complete_term("s")[0] == "streamlit"
+
+
+def test_most_frequent_terms_of_a_small_prefix(crowded_index):
+    assert crowded_index.complete_term("stre") == ["streamlit"]
+    assert crowded_index.complete_term("staa", k=3) == ["staaa", "staab", "staac"]
+
+
+def test_crowded_prefix_matches_the_popular_titles(crowded_index):
+    suggestions = crowded_index.suggest("crash st")
+
+    assert suggestions["completions"][0] == "crash streamlit"
+    assert suggestions["issues"][0][1] == "streamlit app crash"
@@ -0,0 +1,69 @@
+import pandas as pd
+
+from streamlitissues.summarization import StubSummaryBackend, load_summary_cache, summarize_issues
+
+
+class CountingBackend(StubSummaryBackend):
+    """The stub backend, recording the texts it was asked to summarize."""
+
+    def __init__(self, fail_after=None, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_after = fail_after
+        self.summarized = []
+
+    def summarize(self, texts):
+        if self.fail_after is not None and len(self.summarized) >= self.fail_after:
+            raise RuntimeError("interrupted")
+        self.summarized += texts
+        return super().summarize(texts)
+
+
+def make_issues(updated_at=("2024-01-01",) * 4):
+    return pd.DataFrame({
+        "number": [1, 2, 3, 4],
+        "updated_at": list(updated_at),
+        "title": ["Button", "Dataframe", "Chart", "Form"],
+        "body": [f"Issue {n} body. More details here." for n in range(1, 5)],
+    })
+
+
+def test_stub_summaries(tmp_path):
+    summaries = summarize_issues(make_issues(), StubSummaryBackend(), cache_path=str(tmp_path / "s.jsonl"))
+
+    assert summaries == [
+        "Button Issue 1 body. More details here.",
+        "Dataframe Issue 2 body. More details here.",
+        "Chart Issue 3 body. More details here.",
+        "Form Issue 4 body. More details here.",
+    ]
+
+
+def test_interrupted_run_resumes_from_cache(tmp_path):
+    cache_path = str(tmp_path / "s.jsonl")
+    interrupted = CountingBackend(fail_after=2)
+    try:
+        summarize_issues(make_issues(), interrupted, cache_path=cache_path, batch_size=2)
+    except RuntimeError:
+        pass
+    assert set(load_summary_cache(cache_path)) == {1, 2}
+
+    backend = CountingBackend()
+    summaries = summarize_issues(make_issues(), backend, cache_path=cache_path, batch_size=2)
+
+    # only the issues missing from the cache are summarized again
+    assert [text.split("\n")[0] for text in backend.summarized] == ["Chart", "Form"]
+    assert summaries == summarize_issues(make_issues(), StubSummaryBackend())
+
+
+def test_updated_issues_are_refreshed(tmp_path):
+    cache_path = str(tmp_path / "s.jsonl")
+    summarize_issues(make_issues(), CountingBackend(), cache_path=cache_path)
+
+    backend = CountingBackend()
+    updated = make_issues(updated_at=("2024-01-01", "2024-02-01", "2024-01-01", "2024-01-01"))
+    updated.loc[1, "body"] = "Rewritten body."
+    summaries = summarize_issues(updated, backend, cache_path=cache_path)
+
+    assert backend.summarized == ["Dataframe\nRewritten body."]
+    assert summaries[1] == "Dataframe Rewritten body."
+    assert load_summary_cache(cache_path)[2] == ("2024-02-01", "Dataframe Rewritten body.")